@@ -0,0 +1,361 @@
+import argparse
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import geopandas as gpd
+import matplotlib
+import numpy as np
+import pandas as pd
+import shapely
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from typing import Dict, Iterator, List, Optional
+
+SRC_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+matplotlib.use('Agg')
+
+import synthetic  # noqa: E402
+import main  # noqa: E402
+from bar_chart import create_bar_chart  # noqa: E402
+from dataframe_joiner import join_results, read_counts  # noqa: E402
+from heatmap_creator import create_heat_map  # noqa: E402
+from line_chart import create_line_chart  # noqa: E402
+from road_graph import RoadGraph, build_node_index, create_graph, load_graph, nearest_nodes, to_planar  # noqa: E402
+from routing import route_batch  # noqa: E402
+from start_end_map import create_start_end_map  # noqa: E402
+from tile_pyramid import create_tile_pyramid  # noqa: E402
+from trajectory import create_trajectory_map  # noqa: E402
+from trip_loader import load_trips, read_trips_csv  # noqa: E402
+
+# First day of the synthetic trips
+START_DAY: datetime = datetime(2023, 4, 1)
+
+# Trip pairs routed one by one with get_shortest_path_lines, and checked against scipy
+ROUTE_SAMPLE: int = 200
+
+# Trip endpoints checked against a brute-force nearest node search
+SNAP_SAMPLE: int = 2000
+
+# Number of result shapefiles rolled up by dataframe_joiner
+JOIN_SHARDS: int = 4
+
+
+@contextmanager
+def timed(stages: Dict[str, float], stage: str) -> Iterator[None]:
+    """
+    Measures the wall time of a block and stores it under the stage name.
+
+    Parameters
+    ----------
+    stages : dict
+        Timings of the benchmark run, in seconds by stage.
+    stage : str
+        Name of the stage.
+    """
+    start: float = time.perf_counter()
+    yield
+    stages[stage] = time.perf_counter() - start
+    print(f"  {stage}: {stages[stage]:.3f} s")
+
+
+def source_version() -> Optional[str]:
+    """
+    Returns the git commit of the benchmarked code.
+
+    Returns
+    -------
+    str or None
+        Commit hash, with a '+' if the tree has uncommitted changes, or None outside a git checkout.
+    """
+    try:
+        commit: str = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SRC_DIR, capture_output=True, text=True,
+                                     check=True).stdout.strip()
+        changes: str = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=SRC_DIR,
+                                      capture_output=True, text=True, check=True).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('+' if changes else '')
+
+
+def result_counts(shapefile: str) -> pd.DataFrame:
+    """
+    Reads the road counts of a result shapefile, ordered by road.
+
+    Parameters
+    ----------
+    shapefile : str
+        Path to a shapefile written by main.map_trips_to_roads.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Count columns indexed by 'road_id'.
+    """
+    return read_counts(shapefile).set_index('road_id').sort_index()
+
+
+def shortest_distances(graph: RoadGraph, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    """
+    Computes reference shortest path lengths with scipy's Dijkstra implementation.
+
+    Parameters
+    ----------
+    graph : RoadGraph
+        Graph to search.
+    sources : numpy.ndarray
+        Ids of the start nodes.
+    targets : numpy.ndarray
+        Ids of the end nodes, one per source.
+
+    Returns
+    -------
+    numpy.ndarray
+        Path length of every pair in meters, inf where the target cannot be reached.
+    """
+    adjacency: csr_matrix = csr_matrix((graph.edge_weights[graph.slot_edges], graph.neighbors, graph.indptr),
+                                       shape=(len(graph.nodes), len(graph.nodes)))
+    unique_sources: np.ndarray
+    source_rows: np.ndarray
+    unique_sources, source_rows = np.unique(sources, return_inverse=True)
+    distances: np.ndarray = dijkstra(adjacency, indices=unique_sources)
+    return distances[source_rows.ravel(), targets]
+
+
+def run_scale(trip_count: int, args: argparse.Namespace, work_dir: str) -> dict:
+    """
+    Generates a synthetic city with the given number of trips and times every
+    stage of the pipeline on it. Optimized stages are checked against
+    reference implementations.
+
+    Parameters
+    ----------
+    trip_count : int
+        Number of trips to generate.
+    args : argparse.Namespace
+        Command line arguments of the benchmark.
+    work_dir : str
+        Empty directory the inputs and outputs are written to.
+
+    Returns
+    -------
+    dict
+        Trip count, timings in seconds by stage, parity check results and
+        sizes of the generated data.
+    """
+    stages: Dict[str, float] = {}
+    parity: Dict[str, bool] = {}
+    os.chdir(work_dir)
+    start_day: str = START_DAY.strftime("%d/%m/%Y")
+    end_day: str = (START_DAY + timedelta(days=args.days - 1)).strftime("%d/%m/%Y")
+    start: datetime = START_DAY
+    end: datetime = START_DAY + timedelta(days=args.days) - timedelta(seconds=1)
+    result_shapefile: str = f"{start:%d-%m-%Y}_{end:%d-%m-%Y}.shp"
+
+    print(f"{trip_count} trips:")
+    with timed(stages, 'generate_data'):
+        synthetic.write_road_grid('illinois_highway.shp', args.grid_size, args.spacing, seed=args.seed)
+        locations: np.ndarray = synthetic.trip_locations(args.locations, args.grid_size, args.spacing, seed=args.seed)
+        synthetic.write_trips_csv('trips.csv', trip_count, locations, START_DAY, args.days, seed=args.seed)
+
+    # CSV ingest: plain parse, building the columnar cache, and reading it back
+    with timed(stages, 'csv_ingest'):
+        parsed: pd.DataFrame = read_trips_csv('trips.csv')
+    with timed(stages, 'cache_build'):
+        load_trips('trips.csv')
+    with timed(stages, 'cache_load'):
+        trips: pd.DataFrame = load_trips('trips.csv', start, end)
+    reference: pd.DataFrame = parsed.take(np.argsort(parsed['start_time'].to_numpy(), kind='stable'))
+    parity['cache_load'] = reference.reset_index(drop=True).equals(trips)
+    del parsed, reference
+
+    # Road network
+    city_df: gpd.GeoDataFrame = main.filter_roads(gpd.read_file('illinois_highway.shp'))
+    with timed(stages, 'create_graph'):
+        create_graph(city_df)
+    with timed(stages, 'load_road_network'):
+        city_df, graph_directory = main.load_road_network()
+    graph: RoadGraph = load_graph(graph_directory)
+
+    # Snapping endpoints to nodes (nearest node) and to roads (closest line)
+    valid: pd.DataFrame = trips.dropna(subset=['start_latitude', 'start_longitude'])
+    longitudes: np.ndarray = np.concatenate((valid['start_longitude'], valid['end_longitude']))
+    latitudes: np.ndarray = np.concatenate((valid['start_latitude'], valid['end_latitude']))
+    with timed(stages, 'snap_nodes'):
+        snapped: np.ndarray = nearest_nodes(build_node_index(graph), longitudes, latitudes)
+    with timed(stages, 'closest_line'):
+        road_ids, road_distances = main.snap_points(main.build_road_index(city_df), longitudes, latitudes)
+    rng: np.random.Generator = np.random.default_rng(args.seed)
+    sample: np.ndarray = rng.choice(len(snapped), size=min(SNAP_SAMPLE, len(snapped)), replace=False)
+    node_points: np.ndarray = to_planar(graph.nodes[:, 0], graph.nodes[:, 1])
+    sample_points: np.ndarray = to_planar(longitudes[sample], latitudes[sample])
+    brute_force: np.ndarray = np.array([np.min(np.hypot(*(node_points - point).T)) for point in sample_points])
+    parity['snap_nodes'] = bool(np.allclose(np.hypot(*(node_points[snapped[sample]] - sample_points).T), brute_force))
+    # The closest line of every sampled point, scanning all roads as closest_line did before the spatial index
+    roads: np.ndarray = city_df.geometry.to_numpy()
+    points: np.ndarray = shapely.points(longitudes[sample], latitudes[sample])
+    brute_force = np.array([shapely.distance(roads, point).min() for point in points])
+    parity['closest_line'] = bool(np.allclose(road_distances[sample], brute_force) and
+                                  np.allclose(shapely.distance(roads[road_ids[sample]], points), brute_force))
+
+    # Routing single pairs, and the batch router against scipy
+    pairs: np.ndarray = np.unique(np.column_stack(np.split(snapped, 2)), axis=0)
+    pairs = pairs[rng.choice(len(pairs), size=min(ROUTE_SAMPLE, len(pairs)), replace=False)]
+    with timed(stages, 'get_shortest_path_lines'):
+        for source, target in pairs.tolist():
+            main.get_shortest_path_lines(source, target, graph)
+    paths: list = [main.astar(graph, source, target) for source, target in pairs.tolist()]
+    with timed(stages, 'calculate_distance_from_path'):
+        path_distances: np.ndarray = np.array([np.inf if edges is None else
+                                               main.calculate_distance_from_path(graph, edges) for edges in paths])
+    batch_paths: list = route_batch(graph, pairs[:, 0], pairs[:, 1])
+    batch_distances: np.ndarray = np.array([np.inf if edges is None else graph.edge_weights[edges].sum()
+                                            for edges in batch_paths])
+    expected: np.ndarray = shortest_distances(graph, pairs[:, 0], pairs[:, 1])
+    parity['routing'] = bool(np.allclose(path_distances, expected) and np.allclose(batch_distances, expected))
+
+    # Count accumulation, sequential and in worker processes
+    with timed(stages, 'count_road_trips'):
+        counts: np.ndarray = main.count_road_trips(trips, city_df, graph_directory)[0][0]
+    if args.workers > 1:
+        with timed(stages, f'count_road_trips_workers_{args.workers}'):
+            worker_counts: np.ndarray = main.count_road_trips(trips, city_df, graph_directory,
+                                                              workers=args.workers)[0][0]
+        parity['count_workers'] = bool(np.array_equal(counts, worker_counts))
+
+    with timed(stages, 'map_trips_to_roads'):
+        main.map_trips_to_roads(trips, start, end, workers=args.workers)
+    full_counts: pd.DataFrame = result_counts(result_shapefile)
+
+    # Per-day partitions, first counted and then reused
+    with timed(stages, 'incremental_first_run'):
+        main.map_trips_to_roads(trips, start, end, workers=args.workers, partition_dir='daily_counts')
+    with timed(stages, 'incremental_reuse'):
+        main.map_trips_to_roads(trips, start, end, workers=args.workers, partition_dir='daily_counts')
+    parity['incremental'] = result_counts(result_shapefile).equals(full_counts)
+
+    # Rolling up result shapefiles that split the counts between them
+    result_df: gpd.GeoDataFrame = gpd.read_file(result_shapefile)
+    count_columns: List[str] = [column for column in result_df.columns if column.startswith('count_')]
+    shard_files: List[str] = []
+    for shard in range(JOIN_SHARDS):
+        shard_df: gpd.GeoDataFrame = result_df.copy()
+        for column in count_columns:
+            shard_df[column] = (result_df[column] + JOIN_SHARDS - 1 - shard) // JOIN_SHARDS
+        shard_files.append(f"shard_{shard}.shp")
+        shard_df.to_file(shard_files[-1])
+    with timed(stages, 'dataframe_joiner'):
+        joined: gpd.GeoDataFrame = join_results(shard_files)
+    parity['dataframe_joiner'] = bool(
+        (joined.set_index('road_id').sort_index()[count_columns] == full_counts[count_columns]).all().all())
+
+    # Charts and maps
+    with timed(stages, 'heat_map'):
+        create_heat_map(result_shapefile, workers=args.workers)
+    with timed(stages, 'start_end_map'):
+        create_start_end_map(trips, start_day, end_day, result_shapefile)
+    with timed(stages, 'trajectory_map'):
+        create_trajectory_map(trips, start_day, end_day, result_shapefile)
+    with timed(stages, 'trajectory_map_raster'):
+        create_trajectory_map(trips, start_day, end_day, result_shapefile, raster=True)
+    with timed(stages, 'line_chart'):
+        create_line_chart(trips, start_day, end_day)
+    with timed(stages, 'bar_chart'):
+        create_bar_chart(trips, start_day, end_day)
+    with timed(stages, 'tile_pyramid'):
+        create_tile_pyramid(result_shapefile, 'tiles', max_zoom=args.max_zoom, workers=args.workers)
+
+    print(f"  parity: {parity}")
+    return {
+        'trips': trip_count,
+        'rows': len(trips),
+        'roads': len(city_df),
+        # Trips passing the distance check, counted once per road they use
+        'road_trips': int(full_counts[['count_work', 'count_free']].to_numpy().sum()),
+        'stages': stages,
+        'parity': parity,
+    }
+
+
+def compare(baseline_file: str, results: dict) -> None:
+    """
+    Prints the time of every stage relative to an earlier benchmark run.
+
+    Parameters
+    ----------
+    baseline_file : str
+        JSON file written by an earlier run.
+    results : dict
+        Results of the current run.
+    """
+    with open(baseline_file) as file:
+        baseline: dict = json.load(file)
+    print(f"Compared to {baseline.get('version')}:")
+    baseline_scales: dict = {scale['trips']: scale for scale in baseline['scales']}
+    for scale in results['scales']:
+        previous: Optional[dict] = baseline_scales.get(scale['trips'])
+        if previous is None:
+            continue
+        print(f"{scale['trips']} trips:")
+        for stage, seconds in scale['stages'].items():
+            if stage in previous['stages'] and previous['stages'][stage] > 0:
+                print(f"  {stage}: {previous['stages'][stage]:.3f} s -> {seconds:.3f} s "
+                      f"({seconds / previous['stages'][stage]:.2f}x)")
+
+
+if __name__ == '__main__':
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        description="Benchmarks the pipeline stages on synthetic road grids and trip CSVs.")
+    parser.add_argument('--trips', type=int, nargs='+', default=[10_000, 100_000],
+                        help="Numbers of trips to benchmark, e.g. 10000 100000 1000000 10000000.")
+    parser.add_argument('--grid-size', type=int, default=60, help="Number of blocks along each side of the road grid.")
+    parser.add_argument('--spacing', type=float, default=200.0, help="Length of a block in meters.")
+    parser.add_argument('--locations', type=int, default=800, help="Number of distinct trip endpoints.")
+    parser.add_argument('--days', type=int, default=30, help="Number of days the trips are spread over.")
+    parser.add_argument('--workers', type=int, default=1, help="Number of worker processes of the parallel stages.")
+    parser.add_argument('--max-zoom', type=int, default=12, help="Highest zoom level of the tile pyramid.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic data.")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON file to write the results to.")
+    parser.add_argument('--compare', help="JSON file of an earlier run to compare the timings with.")
+    parser.add_argument('--work-dir', help="Directory for the generated data (default is a temporary directory).")
+    args: argparse.Namespace = parser.parse_args()
+
+    output: str = os.path.abspath(args.output)
+    baseline: Optional[str] = os.path.abspath(args.compare) if args.compare else None
+    results: dict = {
+        'version': source_version(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'parameters': {key: value for key, value in vars(args).items()
+                       if key not in ('output', 'compare', 'work_dir')},
+        'scales': [],
+    }
+    for trip_count in args.trips:
+        work_dir: str = (os.path.join(os.path.abspath(args.work_dir), str(trip_count)) if args.work_dir
+                         else tempfile.mkdtemp(prefix='scooter_benchmark_'))
+        os.makedirs(work_dir, exist_ok=True)
+        try:
+            results['scales'].append(run_scale(trip_count, args, work_dir))
+        finally:
+            os.chdir(os.path.dirname(output))
+            if not args.work_dir:
+                shutil.rmtree(work_dir, ignore_errors=True)
+        # Keep the finished scales if a larger one fails
+        with open(output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if baseline is not None:
+        compare(baseline, results)
+    failed: List[str] = [f"{scale['trips']}: {check}" for scale in results['scales']
+                         for check, passed in scale['parity'].items() if not passed]
+    if failed:
+        sys.exit(f"Parity checks failed: {', '.join(failed)}")
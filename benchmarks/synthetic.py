@@ -0,0 +1,253 @@
+from datetime import datetime
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely import linestrings
+from typing import List, Tuple
+
+# Center of the synthetic city, close to downtown Chicago
+CENTER_LONGITUDE: float = -87.68
+CENTER_LATITUDE: float = 41.86
+
+# Meters per degree of latitude, and of longitude at the center
+METERS_PER_DEGREE: float = 111195.0
+METERS_PER_LONGITUDE: float = METERS_PER_DEGREE * np.cos(np.radians(CENTER_LATITUDE))
+
+# Road types of the synthetic grid and how often they occur. The last one is
+# not kept by main.filter_roads.
+GRID_ROAD_TYPES: List[str] = ['residential', 'footway', 'service', 'cycleway', 'motorway']
+GRID_TYPE_WEIGHTS: List[float] = [0.6, 0.2, 0.1, 0.05, 0.05]
+
+# Column layout of the city trip export
+TRIP_CSV_COLUMNS: List[str] = [
+    'trip_id', 'start_time', 'end_time', 'trip_distance', 'trip_duration', 'vendor',
+    'start_community_area_number', 'end_community_area_number', 'start_community_area_name',
+    'end_community_area_name', 'start_centroid_latitude', 'start_centroid_longitude', 'start_centroid_location',
+    'end_centroid_latitude', 'end_centroid_longitude', 'end_centroid_location',
+]
+TIME_FORMAT: str = "%m/%d/%Y %I:%M:%S %p"
+VENDORS: List[str] = ['Lime', 'Lyft', 'Link']
+
+# Rows generated and written at a time
+ROWS_PER_CHUNK: int = 1_000_000
+
+
+def grid_extent(size: int, spacing: float) -> Tuple[float, float, float, float]:
+    """
+    Returns the bounding box of a synthetic road grid.
+
+    Parameters
+    ----------
+    size : int
+        Number of blocks along each side of the grid.
+    spacing : float
+        Length of a block in meters.
+
+    Returns
+    -------
+    tuple of float
+        Minimum longitude, minimum latitude, maximum longitude and maximum latitude.
+    """
+    half_width: float = size * spacing / 2
+    return (CENTER_LONGITUDE - half_width / METERS_PER_LONGITUDE, CENTER_LATITUDE - half_width / METERS_PER_DEGREE,
+            CENTER_LONGITUDE + half_width / METERS_PER_LONGITUDE, CENTER_LATITUDE + half_width / METERS_PER_DEGREE)
+
+
+def write_road_grid(filename: str, size: int = 60, spacing: float = 200.0, seed: int = 0) -> gpd.GeoDataFrame:
+    """
+    Writes a Chicago-like road shapefile: a square street grid whose blocks
+    are separate lines with a shape point in their middle, like the road
+    segments of the OpenStreetMap export. A few blocks are left out, so the
+    grid is not perfectly regular.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the shapefile to write.
+    size : int, optional
+        Number of blocks along each side of the grid (default is 60).
+    spacing : float, optional
+        Length of a block in meters (default is 200).
+    seed : int, optional
+        Seed of the random generator (default is 0).
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+        Roads written to the shapefile.
+    """
+    rng: np.random.Generator = np.random.default_rng(seed)
+    lon_min, lat_min, lon_max, lat_max = grid_extent(size, spacing)
+    longitudes: np.ndarray = np.linspace(lon_min, lon_max, 2 * size + 1)
+    latitudes: np.ndarray = np.linspace(lat_min, lat_max, 2 * size + 1)
+
+    # Every block runs between two neighbouring intersections through the point between them
+    i: np.ndarray
+    j: np.ndarray
+    i, j = np.meshgrid(np.arange(0, 2 * size + 1, 2), np.arange(0, 2 * size - 1, 2), indexing='ij')
+    i, j = i.ravel(), j.ravel()
+    steps: np.ndarray = np.arange(3)
+    east_west: np.ndarray = np.stack((longitudes[j[:, None] + steps], np.repeat(latitudes[i][:, None], 3, axis=1)),
+                                     axis=-1)
+    north_south: np.ndarray = np.stack((np.repeat(longitudes[i][:, None], 3, axis=1), latitudes[j[:, None] + steps]),
+                                       axis=-1)
+    coordinates: np.ndarray = np.concatenate((east_west, north_south))
+    coordinates = coordinates[rng.random(len(coordinates)) >= 0.03]
+
+    roads: gpd.GeoDataFrame = gpd.GeoDataFrame({
+        'TYPE': rng.choice(GRID_ROAD_TYPES, size=len(coordinates), p=GRID_TYPE_WEIGHTS),
+        'NAME': [f"Street {k}" for k in range(len(coordinates))],
+        'ONEWAY': 'no',
+    }, geometry=linestrings(coordinates), crs='EPSG:4326')
+    roads.to_file(filename)
+    return roads
+
+
+def trip_locations(count: int, size: int, spacing: float, seed: int = 0) -> np.ndarray:
+    """
+    Draws the trip endpoints of a synthetic city. Like the community area and
+    census tract centroids of the city export, trips only start and end at a
+    fixed set of points.
+
+    Parameters
+    ----------
+    count : int
+        Number of locations.
+    size : int
+        Number of blocks along each side of the grid, see write_road_grid.
+    spacing : float
+        Length of a block in meters.
+    seed : int, optional
+        Seed of the random generator (default is 0).
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (count, 2) with longitudes and latitudes.
+    """
+    rng: np.random.Generator = np.random.default_rng(seed)
+    lon_min, lat_min, lon_max, lat_max = grid_extent(size, spacing)
+    return np.column_stack((rng.uniform(lon_min, lon_max, count), rng.uniform(lat_min, lat_max, count)))
+
+
+def generate_trips(
+    count: int,
+    locations: np.ndarray,
+    start_day: datetime,
+    days: int,
+    first_id: int = 0,
+    seed: int = 0
+) -> pd.DataFrame:
+    """
+    Generates trips in the column layout of the city trip export. Popular
+    locations get more trips, times are rounded to the hour as in the export,
+    and the reported distance scatters around the grid distance, so only part
+    of the trips pass the path distance check. About 1% of the rows have an
+    invalid start time and 1% have no start location.
+
+    Parameters
+    ----------
+    count : int
+        Number of trips.
+    locations : numpy.ndarray
+        Trip endpoints, see trip_locations.
+    start_day : datetime
+        First day of the trips.
+    days : int
+        Number of days the trips are spread over.
+    first_id : int, optional
+        Number in the id of the first trip (default is 0).
+    seed : int, optional
+        Seed of the random generator (default is 0).
+
+    Returns
+    -------
+    pandas.DataFrame
+        Trips with the columns of TRIP_CSV_COLUMNS.
+    """
+    rng: np.random.Generator = np.random.default_rng(seed)
+    popularity: np.ndarray = 1 / np.arange(1, len(locations) + 1)
+    popularity /= popularity.sum()
+    starts: np.ndarray = rng.choice(len(locations), size=count, p=popularity)
+    ends: np.ndarray = rng.choice(len(locations), size=count, p=popularity)
+
+    # Grid distance between the endpoints, scattered by the detours riders take
+    difference: np.ndarray = np.abs(locations[starts] - locations[ends])
+    grid_distance: np.ndarray = difference[:, 0] * METERS_PER_LONGITUDE + difference[:, 1] * METERS_PER_DEGREE
+    trip_distances: np.ndarray = np.round(grid_distance * rng.lognormal(0.05, 0.1, count), 1)
+    durations: np.ndarray = np.maximum(60, np.round(trip_distances / rng.uniform(2, 5, count))).astype(np.int64)
+
+    hours: np.ndarray = rng.integers(0, days * 24, count)
+    start_times: pd.DatetimeIndex = pd.Timestamp(start_day) + pd.to_timedelta(hours, unit='h')
+    end_times: pd.DatetimeIndex = start_times + pd.to_timedelta(np.round(durations / 3600), unit='h')
+
+    def format_times(times: pd.DatetimeIndex) -> np.ndarray:
+        # Few distinct hours, so format each of them once
+        codes, uniques = pd.factorize(times)
+        return uniques.strftime(TIME_FORMAT).to_numpy()[codes]
+
+    start_text: np.ndarray = format_times(start_times)
+    start_text[rng.random(count) < 0.01] = ''
+    areas: np.ndarray = np.arange(len(locations)) % 77 + 1
+    points: np.ndarray = np.array([f"POINT ({lon} {lat})" for lon, lat in locations], dtype=object)
+    start_latitudes: np.ndarray = locations[starts, 1].copy()
+    start_longitudes: np.ndarray = locations[starts, 0].copy()
+    start_points: np.ndarray = points[starts]
+    missing: np.ndarray = rng.random(count) < 0.01
+    start_latitudes[missing] = np.nan
+    start_longitudes[missing] = np.nan
+    start_points[missing] = ''
+
+    return pd.DataFrame({
+        'trip_id': np.char.add('trip', np.arange(first_id, first_id + count).astype(str)),
+        'start_time': start_text,
+        'end_time': format_times(end_times),
+        'trip_distance': trip_distances,
+        'trip_duration': durations,
+        'vendor': rng.choice(VENDORS, size=count),
+        'start_community_area_number': areas[starts],
+        'end_community_area_number': areas[ends],
+        'start_community_area_name': np.char.add('AREA ', areas[starts].astype(str)),
+        'end_community_area_name': np.char.add('AREA ', areas[ends].astype(str)),
+        'start_centroid_latitude': start_latitudes,
+        'start_centroid_longitude': start_longitudes,
+        'start_centroid_location': start_points,
+        'end_centroid_latitude': locations[ends, 1],
+        'end_centroid_longitude': locations[ends, 0],
+        'end_centroid_location': points[ends],
+    }, columns=TRIP_CSV_COLUMNS)
+
+
+def write_trips_csv(
+    filename: str,
+    count: int,
+    locations: np.ndarray,
+    start_day: datetime,
+    days: int = 30,
+    seed: int = 0
+) -> None:
+    """
+    Writes a synthetic trip CSV in the column layout of the city trip export,
+    see generate_trips. Rows are generated in chunks, so large files do not
+    have to fit in memory.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the CSV file to write.
+    count : int
+        Number of trips.
+    locations : numpy.ndarray
+        Trip endpoints, see trip_locations.
+    start_day : datetime
+        First day of the trips.
+    days : int, optional
+        Number of days the trips are spread over (default is 30).
+    seed : int, optional
+        Seed of the random generator (default is 0).
+    """
+    with open(filename, 'w', newline='') as file:
+        for chunk, first in enumerate(range(0, count, ROWS_PER_CHUNK)):
+            trips_df: pd.DataFrame = generate_trips(min(ROWS_PER_CHUNK, count - first), locations, start_day, days,
+                                                    first_id=first, seed=seed + chunk)
+            trips_df.to_csv(file, header=chunk == 0, index=False)
@@ -1,26 +1,112 @@
+import argparse
+from datetime import datetime
+import glob
 import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyogrio
+from typing import List, Optional
 
-if __name__ == '__main__':
-    # Read shapefiles for four different date ranges
-    city_df_1 = gpd.read_file('../results/01-04-2023_07-04-2023/01-04-2023_07-04-2023.shp')
-    city_df_2 = gpd.read_file('../results/08-04-2023_14-04-2023/08-04-2023_14-04-2023.shp')
-    city_df_3 = gpd.read_file('../results/15-04-2023_21-04-2023/15-04-2023_21-04-2023.shp')
-    city_df_4 = gpd.read_file('../results/22-04-2023_30-04-2023/22-04-2023_30-04-2023.shp')
+from main import load_road_network
+
+
+def shard_paths(patterns: List[str], days: Optional[List[str]] = None, directory: str = '.') -> List[str]:
+    """
+    Lists the result shapefiles to combine.
+
+    Parameters
+    ----------
+    patterns : list of str
+        Paths or glob patterns of result shapefiles.
+    days : list of str, optional
+        Days (dd/mm/yyyy) whose single-day result shapefiles are added.
+    directory : str, optional
+        Directory holding the single-day result shapefiles (default is '.').
+
+    Returns
+    -------
+    list of str
+        Sorted, distinct shapefile paths.
+    """
+    paths: set = {path for pattern in patterns for path in glob.glob(pattern)}
+    for day in days or []:
+        name: str = datetime.strptime(day, "%d/%m/%Y").strftime("%d-%m-%Y")
+        paths.add(f"{directory}/{name}_{name}.shp")
+    return sorted(paths)
+
+
+def read_counts(path: str, road_ids: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """
+    Reads the count columns of a result shapefile. Only the attribute table is
+    read, geometries are not decoded. Result files written before roads had a
+    'road_id' list the roads of the network in order, so their rows are
+    matched to road_ids by position. A ValueError is raised if their number
+    of roads differs from the network.
 
-    # Store all GeoDataFrames in a list
-    dfs = [city_df_1, city_df_2, city_df_3, city_df_4]
+    Parameters
+    ----------
+    path : str
+        Path to a shapefile written by main.map_trips_to_roads.
+    road_ids : numpy.ndarray, optional
+        'road_id' of every road of the network, in order. Needed for result
+        files without a 'road_id' column.
 
-    # Make a copy of the first GeoDataFrame to use as the base for aggregation
-    result = dfs[0].copy()
+    Returns
+    -------
+    pandas.DataFrame
+        'road_id' column followed by the 'count_*' columns.
+    """
+    info: dict = pyogrio.read_info(path)
+    fields: List[str] = info['fields'].tolist()
+    count_fields: List[str] = [field for field in fields if field.startswith('count_')]
+    if 'road_id' in fields:
+        return pyogrio.read_dataframe(path, columns=['road_id'] + count_fields, read_geometry=False)
 
-    # Aggregate the numeric columns (columns 3 to 7) by summing across all GeoDataFrames
-    # 'fill_value=0' ensures missing values are treated as 0 during the sum
-    for df in dfs[1:]:
-        result.iloc[:, 3:8] = result.iloc[:, 3:8].add(df.iloc[:, 3:8], fill_value=0)
+    if road_ids is None:
+        raise ValueError(f"{path} has no 'road_id' column, so its roads cannot be matched")
+    if info['features'] != len(road_ids):
+        raise ValueError(f"{path} has no 'road_id' column and {info['features']} roads, but the road network "
+                         f"has {len(road_ids)}, so its roads cannot be matched by position")
+    counts: pd.DataFrame = pyogrio.read_dataframe(path, columns=count_fields, read_geometry=False)
+    counts.insert(0, 'road_id', road_ids)
+    return counts
 
-    # Restore the original non-numeric columns from the first GeoDataFrame
-    # These are usually identifiers or geometry columns that should not be aggregated
-    result[['TYPE', 'NAME', 'ONEWAY', 'geometry']] = city_df_1[['TYPE', 'NAME', 'ONEWAY', 'geometry']]
 
-    # Save the aggregated GeoDataFrame to a new shapefile
-    result.to_file("01-04-2023_30-04-2023.shp")
+def join_results(paths: List[str]) -> gpd.GeoDataFrame:
+    """
+    Sums the trip counts of several result shapefiles. Roads are matched by
+    their 'road_id', or by position in files without it (see read_counts),
+    and count columns missing from a file count as 0.
+
+    Parameters
+    ----------
+    paths : list of str
+        Shapefiles written by main.map_trips_to_roads for the same road network.
+
+    Returns
+    -------
+    geopandas.GeoDataFrame
+        Roads of the compiled road network with the summed counts.
+    """
+    # Geometry and road attributes come from the compiled network
+    city_df: gpd.GeoDataFrame = load_road_network()[0]
+    road_ids: np.ndarray = city_df['road_id'].to_numpy()
+    counts: pd.DataFrame = pd.concat([read_counts(path, road_ids) for path in paths], ignore_index=True)
+    totals: pd.DataFrame = counts.groupby('road_id').sum()
+    totals = totals.reindex(city_df['road_id'], fill_value=0).astype('int64')
+    return city_df.assign(**{column: totals[column].to_numpy() for column in totals.columns})
+
+
+if __name__ == '__main__':
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="Sum trip counts of several result shapefiles.")
+    parser.add_argument('output', help="Shapefile to write the summed counts to.")
+    parser.add_argument('shards', nargs='*', help="Result shapefiles or glob patterns.")
+    parser.add_argument('--days', nargs='+', default=[], help="Days (dd/mm/yyyy) of single-day results to add.")
+    parser.add_argument('--directory', default='.', help="Directory of the single-day results.")
+    args: argparse.Namespace = parser.parse_args()
+
+    paths: List[str] = shard_paths(args.shards, args.days, args.directory)
+    if not paths:
+        parser.error("no result shapefiles found")
+    print(f"Joining {len(paths)} result files...")
+    join_results(paths).to_file(args.output)
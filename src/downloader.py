@@ -1,50 +1,483 @@
 import requests
 import zipfile
 import os
+import io
+import json
+import queue
+import threading
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import BinaryIO, List, Optional
 from tqdm import tqdm
 
-def download_file(url: str, filename: str) -> None:
-    """Download a file from a given URL with a progress bar.
+import trip_loader
+
+# Bytes read from the network per write
+BLOCK_SIZE: int = 1 << 20
+
+# Bytes fetched by one range request
+PART_SIZE: int = 32 << 20
+
+# Number of range requests fetched in parallel
+CONNECTIONS: int = 4
+
+# Seconds to wait for the server before giving up
+TIMEOUT: float = 60
+
+# Blocks held in memory between a streamed download and its reader
+STREAM_BLOCKS: int = 64
+
+# Suffixes of the partial download, its progress and the validators of a finished download
+PART_SUFFIX: str = '.part'
+STATE_SUFFIX: str = '.part.json'
+METADATA_SUFFIX: str = '.download.json'
+
+
+def remote_metadata(session: requests.Session, url: str) -> dict:
+    """Read the size and validators of a remote file without downloading it.
 
     Args:
-        url (str): The URL to download the file from.
-        filename (str): The local path where the file will be saved.
+        session (requests.Session): Session used for the requests.
+        url (str): The URL of the file.
+
+    Returns:
+        dict: Final URL after redirects, size in bytes (None if unknown),
+            ETag and Last-Modified headers (None if missing) and whether the
+            server accepts byte range requests.
+    """
+    response = session.head(url, allow_redirects=True, timeout=TIMEOUT)
+    if not response.ok:
+        # Some servers do not answer HEAD, so read the headers of a GET instead
+        response = session.get(url, stream=True, timeout=TIMEOUT)
+        response.close()
+    response.raise_for_status()
+
+    length = response.headers.get('Content-Length')
+    return {
+        'url': response.url,
+        'size': int(length) if length is not None else None,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'ranges': response.headers.get('Accept-Ranges', '').lower() == 'bytes',
+    }
+
+
+def same_version(local: dict, remote: dict) -> bool:
+    """Check whether stored validators describe the same remote file version.
+
+    The ETag or Last-Modified header must be known on both sides, the size
+    alone does not tell versions apart.
+
+    Args:
+        local (dict): Validators stored with a download, see remote_metadata.
+        remote (dict): Current validators of the remote file.
+
+    Returns:
+        bool: False if the size, ETag or Last-Modified header differs, or if
+        no ETag or Last-Modified header can be compared.
+    """
+    known = [key for key in ('size', 'etag', 'last_modified')
+             if local.get(key) is not None and remote[key] is not None]
+    return (any(key != 'size' for key in known) and
+            all(local.get(key) == remote[key] for key in known))
+
+
+def is_current(filename: str, remote: dict) -> bool:
+    """Check whether a local file is the current version of a remote file.
+
+    The size of the file must match the remote size, and the validators
+    stored with the download must match the current ones, see same_version.
+    A file without stored validators, e.g. from an older download, must also
+    be modified after the Last-Modified header of the server. If the server
+    sends neither the size nor Last-Modified, such a file cannot be checked
+    and is not considered current.
+
+    Args:
+        filename (str): The local path of the file.
+        remote (dict): Current validators of the remote file, see remote_metadata.
+
+    Returns:
+        bool: True if the file does not have to be downloaded again.
+    """
+    if not os.path.exists(filename):
+        return False
+    if remote['size'] is not None and os.path.getsize(filename) != remote['size']:
+        return False
+    if not os.path.exists(filename + METADATA_SUFFIX):
+        if remote['last_modified'] is not None:
+            return os.path.getmtime(filename) >= parsedate_to_datetime(remote['last_modified']).timestamp()
+        return remote['size'] is not None
+    with open(filename + METADATA_SUFFIX) as file:
+        return same_version(json.load(file), remote)
+
+
+def download_part(session: requests.Session, remote: dict, filename: str, start: int, end: int, bar: tqdm) -> None:
+    """Download one byte range of a file into its place in a partial file.
+
+    Args:
+        session (requests.Session): Session used for the request.
+        remote (dict): Validators of the remote file, see remote_metadata.
+        filename (str): Path of the partial file, already of full size.
+        start (int): First byte of the range.
+        end (int): Last byte of the range, inclusive.
+        bar (tqdm): Progress bar updated with the downloaded bytes.
 
     Returns:
         None
     """
-    response = requests.get(url, stream=True)
-    total_size = int(response.headers.get('content-length', 0))
-    block_size = 1024
-
-    with open(filename, 'wb') as file, tqdm(
-        total=total_size, unit='iB', unit_scale=True, desc=filename
-    ) as bar:
-        for data in response.iter_content(block_size):
+    headers = {'Range': f'bytes={start}-{end}'}
+    # If the file changed on the server, it answers with the whole new file, weak ETags are not allowed here
+    validator = remote['last_modified']
+    if remote['etag'] is not None and not remote['etag'].startswith('W/'):
+        validator = remote['etag']
+    if validator is not None:
+        headers['If-Range'] = validator
+
+    with session.get(remote['url'], headers=headers, stream=True, timeout=TIMEOUT) as response:
+        response.raise_for_status()
+        if response.status_code != 206:
+            raise IOError(f"{remote['url']} changed or ignored the range request while downloading")
+        with open(filename, 'r+b') as file:
+            file.seek(start)
+            for data in response.iter_content(BLOCK_SIZE):
+                file.write(data)
+                bar.update(len(data))
+            if file.tell() != end + 1:
+                raise IOError(f"Incomplete range {start}-{end} of {remote['url']}")
+
+
+def download_parts(session: requests.Session, remote: dict, filename: str, connections: int) -> None:
+    """Download a file as byte ranges fetched in parallel, resuming earlier attempts.
+
+    Finished ranges are recorded next to the partial file, so an interrupted
+    download only fetches the missing ranges again, as long as the remote
+    file did not change in between.
+
+    Args:
+        session (requests.Session): Session used for the requests.
+        remote (dict): Validators of the remote file, see remote_metadata.
+        filename (str): Path of the partial file.
+        connections (int): Number of ranges fetched in parallel.
+
+    Returns:
+        None
+    """
+    state_file = filename[:-len(PART_SUFFIX)] + STATE_SUFFIX
+    state = {**remote, 'done': []}
+    if os.path.exists(filename) and os.path.exists(state_file):
+        with open(state_file) as file:
+            previous = json.load(file)
+        if previous['size'] == remote['size'] and same_version(previous, remote):
+            state['done'] = previous['done']
+    if not state['done']:
+        with open(filename, 'wb') as file:
+            file.truncate(remote['size'])
+
+    size = remote['size']
+    done = set(state['done'])
+    parts = [i for i in range(-(-size // PART_SIZE)) if i not in done]
+    done_bytes = size - sum(min(PART_SIZE, size - i * PART_SIZE) for i in parts)
+
+    def fetch(part: int) -> None:
+        download_part(session, remote, filename, part * PART_SIZE, min((part + 1) * PART_SIZE, size) - 1, bar)
+
+    with tqdm(total=size, initial=done_bytes, unit='iB', unit_scale=True, desc=filename) as bar, \
+            ThreadPoolExecutor(connections) as executor:
+        futures = {executor.submit(fetch, part): part for part in parts}
+        # A failed range does not stop the others, so a later attempt only repeats the failed ones
+        errors = []
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                errors.append(future.exception())
+                continue
+            state['done'].append(futures[future])
+            with open(state_file, 'w') as file:
+                json.dump(state, file)
+    if errors:
+        raise errors[0]
+
+    if os.path.getsize(filename) != size:
+        raise IOError(f"Downloaded size of {filename} does not match {size} bytes")
+    os.remove(state_file)
+
+
+def download_stream(session: requests.Session, remote: dict, filename: str) -> None:
+    """Download a file in a single stream, for servers without range requests.
+
+    Args:
+        session (requests.Session): Session used for the request.
+        remote (dict): Validators of the remote file, see remote_metadata.
+        filename (str): Path of the partial file.
+
+    Returns:
+        None
+    """
+    with session.get(remote['url'], stream=True, timeout=TIMEOUT) as response, open(filename, 'wb') as file, \
+            tqdm(total=remote['size'], unit='iB', unit_scale=True, desc=filename) as bar:
+        response.raise_for_status()
+        for data in response.iter_content(BLOCK_SIZE):
             file.write(data)
             bar.update(len(data))
 
+    if remote['size'] is not None and os.path.getsize(filename) != remote['size']:
+        raise IOError(f"Downloaded size of {filename} does not match {remote['size']} bytes")
+
+
+def download_file(url: str, filename: str, connections: int = CONNECTIONS) -> bool:
+    """Download a file from a given URL with a progress bar.
+
+    The file is skipped if it is already the current version, see is_current.
+    If the server accepts range requests and reports the size, the file is
+    fetched as ranges over several connections and an interrupted download
+    resumes where it stopped. The file only appears under its name once it is
+    complete.
+
+    Args:
+        url (str): The URL to download the file from.
+        filename (str): The local path where the file will be saved.
+        connections (int, optional): Number of parallel range requests.
+
+    Returns:
+        bool: True if the file was downloaded, False if it was already current.
+    """
+    with requests.Session() as session:
+        # Ranges and sizes refer to the stored bytes, so ask for them uncompressed
+        session.headers['Accept-Encoding'] = 'identity'
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=connections)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        remote = remote_metadata(session, url)
+        if is_current(filename, remote):
+            print(f"{filename} is up to date.")
+            return False
+
+        part_file = filename + PART_SUFFIX
+        if remote['ranges'] and remote['size']:
+            download_parts(session, remote, part_file, connections)
+        else:
+            download_stream(session, remote, part_file)
+
+    os.replace(part_file, filename)
+    with open(filename + METADATA_SUFFIX, 'w') as file:
+        json.dump(remote, file)
+    return True
+
+
+class DownloadStream(io.RawIOBase):
+    """Readable stream of a file downloaded by a background thread.
+
+    Blocks are handed from the download thread to the reader through a
+    bounded queue, so the network and the reader work at the same time and a
+    slow reader pauses the download. Errors of the download are raised by
+    the reader, instead of ending the stream early.
+    """
+
+    def __init__(self, session: requests.Session, remote: dict, filename: Optional[str]) -> None:
+        """Start the download thread.
+
+        Args:
+            session (requests.Session): Session used for the request, closed
+                by the download thread when it ends.
+            remote (dict): Validators of the remote file, see remote_metadata.
+            filename (str, optional): If given, the downloaded bytes are also
+                saved there.
+        """
+        super().__init__()
+        self.blocks: queue.Queue = queue.Queue(STREAM_BLOCKS)
+        self.pending: memoryview = memoryview(b'')
+        self.stopped: threading.Event = threading.Event()
+        self.thread: threading.Thread = threading.Thread(target=self.download, args=(session, remote, filename),
+                                                         daemon=True)
+        self.thread.start()
+
+    def put(self, block) -> None:
+        """Hand a block to the reader, waiting while the queue is full.
+
+        Args:
+            block (bytes or Exception): Downloaded bytes, b'' at the end of
+                the stream or the error that ended the download.
+        """
+        # Give up once the reader is closed, instead of waiting for it forever
+        while not self.stopped.is_set():
+            try:
+                self.blocks.put(block, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def download(self, session: requests.Session, remote: dict, filename: Optional[str]) -> None:
+        """Download the file in the background thread and queue its blocks.
+
+        The stream ends with b'' once the file is complete, and with the error
+        if the download fails. Stops early when the reader is closed.
+
+        Args:
+            session (requests.Session): Session used for the request.
+            remote (dict): Validators of the remote file.
+            filename (str, optional): Path to save the downloaded bytes to.
+        """
+        file = None if filename is None else open(filename + PART_SUFFIX, 'wb')
+        try:
+            size = 0
+            with session.get(remote['url'], stream=True, timeout=TIMEOUT) as response, \
+                    tqdm(total=remote['size'], unit='iB', unit_scale=True, desc=filename or remote['url']) as bar:
+                response.raise_for_status()
+                for data in response.iter_content(BLOCK_SIZE):
+                    if self.stopped.is_set():
+                        return
+                    if file is not None:
+                        file.write(data)
+                    self.put(data)
+                    size += len(data)
+                    bar.update(len(data))
+            if remote['size'] is not None and size != remote['size']:
+                raise IOError(f"Downloaded size of {remote['url']} does not match {remote['size']} bytes")
 
-def download_datasets() -> None:
+            # The saved file only appears under its name once it is complete
+            if file is not None:
+                file.close()
+                os.replace(filename + PART_SUFFIX, filename)
+                with open(filename + METADATA_SUFFIX, 'w') as metadata:
+                    json.dump(remote, metadata)
+            self.put(b'')
+        except Exception as error:
+            self.put(error)
+        finally:
+            if file is not None:
+                file.close()
+            session.close()
+
+    def readable(self) -> bool:
+        """Return True, the stream can always be read."""
+        return True
+
+    def readinto(self, buffer) -> int:
+        """Read downloaded bytes into a buffer, waiting for the next block.
+
+        An error of the download is raised here. The end of the stream stays
+        in the queue, so every later read returns 0 as well.
+
+        Args:
+            buffer (bytearray or memoryview): Buffer to fill.
+
+        Returns:
+            int: Number of bytes read, 0 at the end of the stream.
+        """
+        if not self.pending:
+            block = self.blocks.get()
+            if isinstance(block, Exception):
+                raise block
+            if not block:
+                # Keep the end of the stream for later reads
+                self.blocks.put(block)
+                return 0
+            self.pending = memoryview(block)
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+    def close(self) -> None:
+        """Close the stream and stop the download thread."""
+        self.stopped.set()
+        super().close()
+
+
+def open_download(url: str, filename: Optional[str] = None, remote: Optional[dict] = None) -> BinaryIO:
+    """Start downloading a file in the background and read it as a stream.
+
+    Args:
+        url (str): The URL to download the file from.
+        filename (str, optional): If given, the downloaded bytes are also
+            saved there, see download_file.
+        remote (dict, optional): Validators of the remote file, if already
+            read with remote_metadata.
+
+    Returns:
+        BinaryIO: Buffered stream of the file content.
+    """
+    session = requests.Session()
+    session.headers['Accept-Encoding'] = 'identity'
+    if remote is None:
+        remote = remote_metadata(session, url)
+    return io.BufferedReader(DownloadStream(session, remote, filename), BLOCK_SIZE)
+
+
+def download_trips(url: str, filename: str, keep_csv: bool = True) -> bool:
+    """Download the trip CSV and parse it into the trip cache while it arrives.
+
+    The download stream is fed straight into the chunked trip parser, so
+    network and parsing overlap and the CSV is never read back from disk.
+    If the CSV is not kept, the cache is tied to the ETag, size and
+    Last-Modified header of the download instead of the CSV, and
+    trip_loader.load_trips reads it without the CSV.
+
+    Args:
+        url (str): The URL of the trip CSV.
+        filename (str): The local path of the trip CSV.
+        keep_csv (bool, optional): Whether to also save the raw CSV.
+
+    Returns:
+        bool: True if the trips were downloaded, False if they were already current.
+    """
+    cache_dir = trip_loader.cache_path(filename)
+    with requests.Session() as session:
+        session.headers['Accept-Encoding'] = 'identity'
+        remote = remote_metadata(session, url)
+    cached = trip_loader.cached_signature(cache_dir)
+    if (cached is not None and cached.get('url') == remote['url'] and same_version(cached, remote)) or \
+            is_current(filename, remote):
+        print(f"{filename} is up to date.")
+        return False
+
+    with open_download(url, filename if keep_csv else None, remote) as stream:
+        trips_df = trip_loader.read_trips_stream(stream)
+    if keep_csv:
+        signature = trip_loader.source_signature(filename)
+    else:
+        signature = {key: remote[key] for key in ('url', 'size', 'etag', 'last_modified')}
+        if os.path.exists(filename):
+            # An older CSV would no longer match the cache
+            os.remove(filename)
+    trip_loader.write_trips_cache(trips_df, cache_dir, signature)
+    return True
+
+
+def download_datasets(stream: bool = False, keep_csv: bool = True) -> None:
     """Download e-scooter trip CSV and Illinois highway shapefile.
 
     The function performs the following steps:
-        1. Downloads the e-scooter trip CSV from the City of Chicago.
-        2. Downloads the Illinois highway shapefile ZIP archive.
+        1. Downloads the e-scooter trip CSV from the City of Chicago,
+           unless the local copy is current.
+        2. Downloads the Illinois highway shapefile ZIP archive,
+           if any of the shapefile files is missing.
         3. Extracts the contents of the ZIP file.
         4. Cleans up unnecessary files (ZIP and readme files).
 
     The CSV is saved as 'e_scooter_trips.csv'.
     The shapefile is extracted to the current directory.
 
+    Args:
+        stream (bool, optional): Parse the trips into the trip cache while
+            downloading them, see download_trips.
+        keep_csv (bool, optional): With stream, whether to also save the raw CSV.
+
     Returns:
         None
     """
     url_scooter = "https://data.cityofchicago.org/api/views/2i5w-ykuw/rows.csv?accessType=DOWNLOAD"
     url_map = "https://mapcruzin.com/download-shapefile/us/illinois_highway.zip"
+    shapefile_files: List[str] = ['illinois_highway.shp', 'illinois_highway.dbf', 'illinois_highway.prj',
+                                  'illinois_highway.shx']
 
     # Download files
-    download_file(url_scooter, "e_scooter_trips.csv")
+    if stream:
+        download_trips(url_scooter, "e_scooter_trips.csv", keep_csv)
+    else:
+        download_file(url_scooter, "e_scooter_trips.csv")
+    if all(os.path.exists(f) for f in shapefile_files):
+        return
     download_file(url_map, "illinois_highway.zip")
 
     # Extract ZIP file
@@ -55,6 +488,7 @@ def download_datasets() -> None:
     files_to_remove = [
         os.path.join(".", "Archive created by free jZip.url"),
         os.path.join(".", "illinois_highway.zip"),
+        os.path.join(".", "illinois_highway.zip" + METADATA_SUFFIX),
         os.path.join(".", "readme.txt"),
     ]
 
@@ -1,62 +1,117 @@
+from concurrent.futures import ProcessPoolExecutor
 import geopandas as gpd
 import matplotlib.pyplot as plt
+import numpy as np
+import shapely
+from matplotlib.collections import LineCollection
+from typing import List, Tuple
 
+# Latitude where zoomed-in maps start, the other limits are shared by all maps
+CUT_LATITUDE: float = 41.85013746994182
+MAP_LIMITS: tuple = ((-87.80370076, -87.5349023379022), (41.66013746994182, 42.00962338))
 
-def show_map(
-    geodataframe: gpd.GeoDataFrame,
-    column: str,
-    title: str = "Map",
-    is_cut: bool = False
-) -> None:
+
+def road_lines(geodataframe: gpd.GeoDataFrame) -> Tuple[List[np.ndarray], np.ndarray]:
     """
-    Plots a GeoDataFrame as a choropleth map with variable line widths
-    depending on the column values and saves it as a PNG file.
+    Extracts the vertex arrays of all road line parts.
 
     Parameters
     ----------
     geodataframe : geopandas.GeoDataFrame
-        The GeoDataFrame containing the spatial data to plot.
-    column : str
-        The column name to use for coloring and line width.
-    title : str, optional
-        The title of the map (default is "Map").
-    is_cut : bool, optional
-        If True, sets a smaller latitude range for a zoomed-in view
-        (default is False).
+        GeoDataFrame containing line geometries in 'geometry' column.
 
     Returns
     -------
-    None
-        Saves the map as a PNG file in the current directory.
+    lines : list of numpy.ndarray
+        Array of shape (k, 2) with the coordinates of every line part, in road order.
+    part_rows : numpy.ndarray
+        Row of the road every line part belongs to.
     """
-    fig, ax = plt.subplots(1, 1, figsize=(30, 20))
+    parts: np.ndarray
+    part_rows: np.ndarray
+    parts, part_rows = shapely.get_parts(geodataframe.geometry.to_numpy(), return_index=True)
+    coords: np.ndarray
+    coord_parts: np.ndarray
+    coords, coord_parts = shapely.get_coordinates(parts, return_index=True)
+    return np.split(coords, np.flatnonzero(np.diff(coord_parts)) + 1), part_rows
 
-    # Define line width based on column value
-    def get_linewidth(value: float) -> float:
-        return 2 if value > 0 else 0.5
-    linewidths = geodataframe[column].apply(get_linewidth)
 
-    # Plot the GeoDataFrame
-    plot = geodataframe.plot(ax=ax, column=column, legend=True, cmap='plasma', linewidth=linewidths)
+def road_collection(geodataframe: gpd.GeoDataFrame) -> Tuple[LineCollection, np.ndarray]:
+    """
+    Builds a single LineCollection with the line parts of all roads.
 
-    # Set map limits: latitude range is adjusted if 'is_cut' is True
-    ax.set_ylim((41.85013746994182 if is_cut else 41.66013746994182, 42.00962338))
-    ax.set_xlim((-87.80370076, -87.5349023379022))
+    Parameters
+    ----------
+    geodataframe : geopandas.GeoDataFrame
+        GeoDataFrame containing line geometries in 'geometry' column.
 
-    # Set title and remove axis ticks
-    ax.set_title(title, fontsize=30)
-    plt.xticks([])
-    plt.yticks([])
+    Returns
+    -------
+    collection : matplotlib.collections.LineCollection
+        Collection with one line per road part, in road order.
+    part_rows : numpy.ndarray
+        Row of the road every line of the collection belongs to.
+    """
+    lines: List[np.ndarray]
+    part_rows: np.ndarray
+    lines, part_rows = road_lines(geodataframe)
+    return LineCollection(lines, cmap='plasma'), part_rows
 
-    # Customize colorbar label
-    colorbar = plot.get_figure().get_axes()[1]
-    colorbar.set_ylabel("Number of trips", fontsize=20)
 
-    # Save the figure
-    plt.savefig(f"{column}_cut.png" if is_cut else f"{column}.png", bbox_inches='tight')
+def render_maps(shape_file: str, columns: List[str], titles: List[str]) -> None:
+    """
+    Renders the zoomed-in and full heat maps of several count columns. The
+    figure and the road lines are created once, only the colours and line
+    widths change between columns.
 
+    Parameters
+    ----------
+    shape_file : str
+        Path to the shapefile containing trip counts.
+    columns : list of str
+        Count columns to render.
+    titles : list of str
+        Title of every map.
 
-def create_heat_map(shape_file: str) -> None:
+    Returns
+    -------
+    None
+        Saves '<column>_cut.png' and '<column>.png' for every column.
+    """
+    geodataframe: gpd.GeoDataFrame = gpd.read_file(shape_file)
+    fig, ax = plt.subplots(1, 1, figsize=(30, 20))
+    collection: LineCollection
+    part_rows: np.ndarray
+    collection, part_rows = road_collection(geodataframe)
+    ax.add_collection(collection)
+
+    # Keep the aspect ratio geopandas uses for geographic coordinates
+    ax.set_aspect(1 / np.cos(np.radians(np.mean(geodataframe.total_bounds[[1, 3]]))))
+    ax.set_xlim(MAP_LIMITS[0])
+    ax.set_xticks([])
+    ax.set_yticks([])
+    colorbar = fig.colorbar(collection, ax=ax)
+    colorbar.set_label("Number of trips", fontsize=20)
+
+    try:
+        for column, title in zip(columns, titles):
+            # Color by count, roads with trips get thicker lines
+            values: np.ndarray = geodataframe[column].to_numpy()[part_rows]
+            collection.set_array(values)
+            collection.set_clim(values.min(), values.max())
+            collection.set_linewidths(np.where(values > 0, 2, 0.5))
+            ax.set_title(title, fontsize=30)
+
+            # Zoomed-in and full maps differ only in their latitude range
+            ax.set_ylim((CUT_LATITUDE, MAP_LIMITS[1][1]))
+            fig.savefig(f"{column}_cut.png", bbox_inches='tight')
+            ax.set_ylim(MAP_LIMITS[1])
+            fig.savefig(f"{column}.png", bbox_inches='tight')
+    finally:
+        plt.close(fig)
+
+
+def create_heat_map(shape_file: str, workers: int = 1) -> None:
     """
     Generates multiple heat maps from a shapefile showing the most
     frequently traveled routes for weekdays, weekends, and by scooter companies.
@@ -65,25 +120,31 @@ def create_heat_map(shape_file: str) -> None:
     ----------
     shape_file : str
         Path to the shapefile containing trip counts.
+    workers : int, optional
+        Number of worker processes the maps are split between (default is 1).
 
     Returns
     -------
     None
-        Calls show_map multiple times and saves PNG maps.
+        Saves a zoomed-in and a full PNG map for every count column.
     """
-    # Load shapefile into a GeoDataFrame
-    city_df: gpd.GeoDataFrame = gpd.read_file(shape_file)
-
-    # Zoomed-in maps (cut) for different trip categories
-    show_map(city_df, 'count_work', "Most frequent routes on weekdays (01.04.2023 - 30.04.2023)", is_cut=True)
-    show_map(city_df, 'count_free', "Most frequent routes on weekends (01.04.2023 - 30.04.2023)", is_cut=True)
-    show_map(city_df, 'count_lime', "Most frequent routes using Lime scooters (01.04.2023 - 30.04.2023)", is_cut=True)
-    show_map(city_df, 'count_lyft', "Most frequent routes using Lyft scooters (01.04.2023 - 30.04.2023)", is_cut=True)
-    show_map(city_df, 'count_link', "Most frequent routes using Link scooters (01.04.2023 - 30.04.2023)", is_cut=True)
-
-    # Full maps (not cut) for different trip categories
-    show_map(city_df, 'count_work', "Most frequent routes on weekdays (01.04.2023 - 30.04.2023)")
-    show_map(city_df, 'count_free', "Most frequent routes on weekends (01.04.2023 - 30.04.2023)")
-    show_map(city_df, 'count_lime', "Most frequent routes using Lime scooters (01.04.2023 - 30.04.2023)")
-    show_map(city_df, 'count_lyft', "Most frequent routes using Lyft scooters (01.04.2023 - 30.04.2023)")
-    show_map(city_df, 'count_link', "Most frequent routes using Link scooters (01.04.2023 - 30.04.2023)")
+    # Only the attribute table is needed to find the count columns
+    columns: List[str] = [column for column in gpd.read_file(shape_file, ignore_geometry=True).columns
+                          if column.startswith('count_')]
+
+    # Titles of the day type columns, vendor columns are named after the vendor
+    day_type_titles: dict = {'count_work': "on weekdays", 'count_free': "on weekends"}
+    titles: List[str] = [
+        f"Most frequent routes {day_type_titles.get(column, f'using {column[6:].capitalize()} scooters')} "
+        f"(01.04.2023 - 30.04.2023)"
+        for column in columns
+    ]
+
+    if workers > 1:
+        shares: List[np.ndarray] = np.array_split(np.arange(len(columns)), min(workers, len(columns)))
+        with ProcessPoolExecutor(len(shares)) as executor:
+            list(executor.map(render_maps, [shape_file] * len(shares),
+                              [[columns[i] for i in share] for share in shares],
+                              [[titles[i] for i in share] for share in shares]))
+    else:
+        render_maps(shape_file, columns, titles)
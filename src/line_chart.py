@@ -3,20 +3,22 @@ import matplotlib.pyplot as plt
 from datetime import datetime
 from typing import Optional
 
+from trip_loader import within_bounds
 
-def read_trips_file(
-        csv_file: str,
+
+def plot_trips_by_hour(
+        trips_df: pd.DataFrame,
         start_date: Optional[datetime] = None,
         end_date: Optional[datetime] = None
 ) -> None:
     """
-    Reads a CSV file containing trip data, filters trips by date and geographic boundaries,
-    aggregates trips by hour for weekdays and weekends, and generates a line chart.
+    Filters trips by date and geographic boundaries, aggregates trips by hour
+    for weekdays and weekends, and generates a line chart.
 
     Parameters
     ----------
-    csv_file : str
-        Path to the CSV file containing trip data.
+    trips_df : pandas.DataFrame
+        Trip table returned by trip_loader.load_trips.
     start_date : datetime, optional
         Start of the date range for filtering trips (default is None).
     end_date : datetime, optional
@@ -27,30 +29,11 @@ def read_trips_file(
     None
         Saves a line chart of trips by hour for weekdays and weekends as a PNG file.
     """
-    # Define geographic boundaries (Chicago)
-    margin = 0.1
-    lon_min = -87.89370076 - margin
-    lon_max = -87.5349023379022 + margin
-    lat_min = 41.66013746994182 - margin
-    lat_max = 42.00962338 + margin
-
-    # Load CSV using pandas, parse datetime columns
-    df: pd.DataFrame = pd.read_csv(
-        csv_file,
-        usecols=[1, 2, 10, 11, 13, 14],  # Only read necessary columns
-        parse_dates=[1, 2],
-        names=['start_time', 'end_time', 'start_lat', 'start_lon', 'end_lat', 'end_lon'],
-        header=0
-    )
-
     # Filter rows with missing coordinates
-    df = df.dropna(subset=['start_lat', 'start_lon', 'end_lat', 'end_lon'])
+    df: pd.DataFrame = trips_df.dropna(subset=['start_latitude', 'start_longitude', 'end_latitude', 'end_longitude'])
 
     # Filter by geographic boundaries
-    df = df[
-        (df['start_lon'].between(lon_min, lon_max)) &
-        (df['start_lat'].between(lat_min, lat_max))
-        ]
+    df = df[within_bounds(df['start_longitude'], df['start_latitude'])]
 
     # Filter by date range if provided
     if start_date:
@@ -58,10 +41,11 @@ def read_trips_file(
     if end_date:
         df = df[df['end_time'] <= end_date]
 
-    # Add weekday, hour, and weekend flags
-    df['weekday'] = df['start_time'].dt.dayofweek
-    df['hour'] = df['start_time'].dt.hour
-    df['is_weekend'] = df['weekday'] >= 5
+    # Add hour and weekend flags
+    df = df.assign(
+        hour=df['start_time'].dt.hour,
+        is_weekend=df['start_time'].dt.dayofweek >= 5
+    )
 
     # Aggregate trips by hour for weekdays and weekends
     weekday_trips: pd.Series = df[~df['is_weekend']].groupby('hour').size()
@@ -85,7 +69,7 @@ def read_trips_file(
 
 
 def create_line_chart(
-        csv_file: str,
+        trips_df: pd.DataFrame,
         start_day: str,
         end_day: str
 ) -> None:
@@ -95,8 +79,8 @@ def create_line_chart(
 
     Parameters
     ----------
-    csv_file : str
-        Path to the CSV file containing trip data.
+    trips_df : pandas.DataFrame
+        Trip table returned by trip_loader.load_trips.
     start_day : str
         Start date in the format 'dd/mm/yyyy'.
     end_day : str
@@ -108,4 +92,4 @@ def create_line_chart(
     """
     start_date: datetime = datetime.strptime(f"{start_day} 00:00:00", "%d/%m/%Y %H:%M:%S")
     end_date: datetime = datetime.strptime(f"{end_day} 23:59:59", "%d/%m/%Y %H:%M:%S")
-    read_trips_file(csv_file, start_date=start_date, end_date=end_date)
+    plot_trips_by_hour(trips_df, start_date=start_date, end_date=end_date)
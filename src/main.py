@@ -1,98 +1,131 @@
 from datetime import datetime
 import geopandas as gpd
-from shapely.geometry import Point, LineString
-import networkx as nx
-from geopy.distance import geodesic
+import pandas as pd
+import numpy as np
+from scipy.spatial import cKDTree
+import shapely
+from shapely import STRtree
 from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import hashlib
 import os
-import sys
-from typing import List, Tuple, Optional
+import zipfile
+from typing import List, Tuple, Optional, Union
 
 import downloader
+from road_graph import (RoadGraph, build_node_index, contract_graph, create_graph, load_graph, locate_on_edges,
+                        nearest_nodes, network_key, save_graph, save_landmarks, split_edges)
+from routing import HEURISTIC_SCALE, astar, compute_landmarks, path_nodes, route_batch
+from trip_loader import LAT_MAX, LAT_MIN, LON_MAX, LON_MIN, cache_path, cached_signature, load_trips, select_date_range
 from start_end_map import create_start_end_map
 from trajectory import create_trajectory_map
 from heatmap_creator import create_heat_map
+from tile_pyramid import create_tile_pyramid
 from line_chart import create_line_chart
 from bar_chart import create_bar_chart
 
+# Road types kept in the road network
+ROAD_TYPES: List[str] = [
+    'living_street', 'service', 'track', 'crossing', 'cycleway', 'residential',
+    'pedestrian', 'footway', 'sidewalk', 'walkway', 'park road', 'cycleway;footway',
+    'cycleway; footway', 'cycleway; footway; footway; footway', 'cycleway; footway; footway',
+    'footway; cycleway', 'service; cycleway', 'secondary'
+]
 
-def closest_line(lines: List[LineString], point: Point) -> LineString:
+# Version of the compiled road network layout, part of its key
+NETWORK_VERSION: int = 2
+
+# Count columns for trips on weekdays and weekends, vendor columns follow them
+DAY_TYPE_COLUMNS: List[str] = ['count_work', 'count_free']
+
+# Largest accepted relative difference between path and reported trip distance
+DISTANCE_TOLERANCE: float = 0.1
+
+# Version of the trip counting rules, part of the key of stored day partitions
+COUNTING_VERSION: int = 1
+
+# Trip columns the road counts depend on
+COUNTED_COLUMNS: List[str] = ['start_time', 'trip_distance', 'vendor', 'start_latitude', 'start_longitude',
+                              'end_latitude', 'end_longitude']
+
+# Shards created per worker process, so slow shards do not leave workers idle
+SHARDS_PER_WORKER: int = 4
+
+# Road graph of a worker process, set by init_worker
+worker_graph: Optional[RoadGraph] = None
+
+def build_road_index(df: gpd.GeoDataFrame) -> STRtree:
     """
-    Finds the closest line from a list of lines to a given point.
+    Builds a spatial index over the road geometries.
 
     Parameters
     ----------
-    lines : list of shapely LineString
-        List of line geometries.
-    point : shapely Point
-        The point to find the closest line to.
+    df : geopandas.GeoDataFrame
+        GeoDataFrame containing line geometries in 'geometry' column.
 
     Returns
     -------
-    shapely LineString
-        The line closest to the given point.
+    shapely.STRtree
+        R-tree over the road lines, in the row order of the GeoDataFrame.
     """
-    distances: List[float] = [line.distance(point) for line in lines]
-    shortest_distance: float = min(distances)
-    return lines[distances.index(shortest_distance)]
+    return STRtree(df.geometry.to_numpy())
 
 
-def create_graph(df: gpd.GeoDataFrame) -> nx.Graph:
+def snap_points(road_index: STRtree, longitudes: np.ndarray, latitudes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Creates a NetworkX graph from a GeoDataFrame of line geometries.
+    Finds the closest road for every point of a batch in a single query.
 
     Parameters
     ----------
-    df : geopandas.GeoDataFrame
-        GeoDataFrame containing line geometries in 'geometry' column.
+    road_index : shapely.STRtree
+        Spatial index built by build_road_index.
+    longitudes : numpy.ndarray
+        Longitudes of the points.
+    latitudes : numpy.ndarray
+        Latitudes of the points.
 
     Returns
     -------
-    networkx.Graph
-        A graph where nodes are coordinates and edges represent line segments.
+    road_indices : numpy.ndarray
+        Row index of the closest road for each point.
+    distances : numpy.ndarray
+        Distance from each point to its road, in coordinate units.
     """
-    g: nx.Graph = nx.Graph()
-    for idx, row in df.iterrows():
-        line: LineString = row['geometry']
-        nodes: List[Tuple[float, float]] = list(line.coords)
-        for i in range(len(nodes) - 1):
-            g.add_edge(nodes[i], nodes[i + 1], weight=line.length, line=line, line_index=idx)
-    return g
+    points: np.ndarray = shapely.points(longitudes, latitudes)
+    nearest: np.ndarray
+    distances: np.ndarray
+    nearest, distances = road_index.query_nearest(points, return_distance=True, all_matches=False)
+    return nearest[1], distances
 
 
-def get_shortest_path_lines(start_point: Tuple[float, float], end_point: Tuple[float, float], g: nx.Graph) -> Tuple[List[Tuple[float, float]], List[int]]:
+def get_shortest_path_lines(start_node: int, end_node: int, graph: RoadGraph) -> Optional[Tuple[np.ndarray, List[int]]]:
     """
-    Finds the shortest path in a graph between two points and returns the corresponding lines.
+    Finds the shortest path in a graph between two nodes and returns the corresponding lines.
 
     Parameters
     ----------
-    start_point : tuple
-        Coordinates of the start point.
-    end_point : tuple
-        Coordinates of the end point.
-    g : networkx.Graph
+    start_node : int
+        Id of the start node.
+    end_node : int
+        Id of the end node.
+    graph : RoadGraph
         Graph created from line geometries.
 
     Returns
     -------
-    shortest_path : list of tuples
-        Sequence of coordinates in the shortest path.
+    shortest_path : numpy.ndarray
+        Array of shape (k, 2) with the coordinates of the nodes along the shortest path.
     line_indices : list of int
         Indices of the lines in the GeoDataFrame that correspond to the path.
+    None
+        Returned instead if the end node cannot be reached.
     """
-    shortest_path: List[Tuple[float, float]] = nx.astar_path(g, start_point, end_point, heuristic=lambda u, v: 0)
-    path_lines: List[LineString] = []
-    line_indices: List[int] = []
-
-    for i in range(len(shortest_path) - 1):
-        edge_data: dict = g.get_edge_data(shortest_path[i], shortest_path[i + 1])
-        if 'line_index' in edge_data:
-            path_lines.append(edge_data['line'])
-            line_indices.append(edge_data['line_index'])
-        else:
-            print(f"Missing 'line_index' for edge between {shortest_path[i]} and {shortest_path[i + 1]}")
-
-    return shortest_path, list(set(line_indices))
+    edges: Optional[np.ndarray] = astar(graph, start_node, end_node)
+    if edges is None:
+        return None
+    shortest_path: np.ndarray = graph.nodes[path_nodes(graph, start_node, edges)]
+    return shortest_path, np.unique(graph.edge_roads[edges]).tolist()
 
 
 def remove_elements_by_indexes(lst: List, indexes: List[int]) -> List:
@@ -115,26 +148,23 @@ def remove_elements_by_indexes(lst: List, indexes: List[int]) -> List:
     return [elem for i, elem in enumerate(lst) if i not in indexes]
 
 
-def calculate_distance_from_path(path: List[Tuple[float, float]]) -> float:
+def calculate_distance_from_path(graph: RoadGraph, edges: np.ndarray) -> float:
     """
-    Calculates the geodesic distance of a path defined by a list of coordinates.
+    Calculates the length of a path from the precomputed lengths of its edges.
 
     Parameters
     ----------
-    path : list of tuples
-        List of (longitude, latitude) coordinates.
+    graph : RoadGraph
+        Graph the path was found in.
+    edges : numpy.ndarray
+        Ids of the edges along the path.
 
     Returns
     -------
     float
         Total path distance in meters.
     """
-    if len(path) <= 1:
-        return 0
-    distances: List[float] = [geodesic(path[i], path[i + 1]).meters for i in range(len(path) - 1)]
-    # Create a LineString representing cumulative distance (optional)
-    linestring: LineString = LineString([(0, 0)] + [(sum(distances[:i + 1]), 0) for i in range(len(distances))])
-    return linestring.length
+    return float(graph.edge_weights[edges].sum())
 
 
 def filter_roads(df: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
@@ -151,138 +181,556 @@ def filter_roads(df: gpd.GeoDataFrame) -> gpd.GeoDataFrame:
     geopandas.GeoDataFrame
         Filtered GeoDataFrame containing only selected road types.
     """
-    valid_types: List[str] = [
-        'living_street', 'service', 'track', 'crossing', 'cycleway', 'residential',
-        'pedestrian', 'footway', 'sidewalk', 'walkway', 'park road', 'cycleway;footway',
-        'cycleway; footway', 'cycleway; footway; footway; footway', 'cycleway; footway; footway',
-        'footway; cycleway', 'service; cycleway', 'secondary'
-    ]
-    return df[df['TYPE'].isin(valid_types)]
+    return df[df['TYPE'].isin(ROAD_TYPES)]
 
 
-def read_trips_file(filename: str, row_limits: Optional[int] = None, start: Optional[datetime] = None, end: Optional[datetime] = None) -> None:
+def load_road_network(shapefile: str = 'illinois_highway.shp', landmarks: int = 0) -> Tuple[gpd.GeoDataFrame, str]:
     """
-    Reads trip data, filters by date and location, maps trips to road network,
-    counts trips by type and vendor, and saves results as a shapefile.
+    Loads the filtered and clipped road network together with its compiled graph.
+    Both are compiled on first use and stored next to the shapefile, keyed by the
+    shapefile content, ROAD_TYPES and the Chicago bounding box. Every road keeps
+    its row in the shapefile as 'road_id', which identifies it in result files.
 
     Parameters
     ----------
-    filename : str
-        Path to the CSV file containing trip data.
-    row_limits : int, optional
-        Maximum number of rows to process from the CSV.
-    start : datetime, optional
-        Start date for filtering trips.
-    end : datetime, optional
-        End date for filtering trips.
+    shapefile : str, optional
+        Path to the road shapefile (default is 'illinois_highway.shp').
+    landmarks : int, optional
+        Number of A* landmarks to store with the compiled graph. Landmarks are
+        computed once per network version and kept for later runs. 0 keeps the
+        stored landmarks as they are (default is 0).
 
     Returns
     -------
-    None
-        Saves the updated GeoDataFrame with trip counts as a shapefile.
+    city_df : geopandas.GeoDataFrame
+        Roads kept in the network, with a 'road_id' column.
+    graph_directory : str
+        Directory of the compiled graph, to be loaded with road_graph.load_graph.
+    """
+    bounds: Tuple[float, float, float, float] = (LON_MIN, LAT_MIN, LON_MAX, LAT_MAX)
+    graph_directory: str = os.path.join(f"{shapefile}.cache",
+                                        network_key(shapefile, NETWORK_VERSION, sorted(ROAD_TYPES), bounds))
+    roads_file: str = os.path.join(graph_directory, 'roads.shp')
+
+    if load_graph(graph_directory) is None:
+        city_df: gpd.GeoDataFrame = filter_roads(gpd.read_file(shapefile))
+        city_df = city_df.cx[LON_MIN:LON_MAX, LAT_MIN:LAT_MAX]
+        city_df = city_df.assign(road_id=city_df.index).reset_index(drop=True)
+        os.makedirs(graph_directory, exist_ok=True)
+        city_df.to_file(roads_file)
+        save_graph(create_graph(city_df), graph_directory)
+
+    graph: RoadGraph = load_graph(graph_directory)
+    if landmarks > 0 and (graph.landmark_distances is None or len(graph.landmark_distances) != landmarks):
+        save_landmarks(compute_landmarks(graph, landmarks), graph_directory)
+    return gpd.read_file(roads_file), graph_directory
+
+
+def count_column(vendor: str) -> str:
+    """
+    Returns the name of the count column of a vendor.
+
+    Parameters
+    ----------
+    vendor : str
+        Vendor name as reported in the trip data.
+
+    Returns
+    -------
+    str
+        Column name, cut to the 10 characters allowed in shapefiles.
+    """
+    return f"count_{vendor.lower()}"[:10]
+
+
+def count_trips(
+    graph: RoadGraph,
+    start_nodes: np.ndarray,
+    end_nodes: np.ndarray,
+    trip_distances: np.ndarray,
+    trip_dimensions: np.ndarray,
+    dimension_count: int,
+    road_count: int,
+    progress: bool = False
+) -> np.ndarray:
+    """
+    Routes trips between their snapped nodes and counts the trips using each road.
+
+    Parameters
+    ----------
+    graph : RoadGraph
+        Graph the nodes belong to.
+    start_nodes : numpy.ndarray
+        Id of the start node of each trip.
+    end_nodes : numpy.ndarray
+        Id of the end node of each trip.
+    trip_distances : numpy.ndarray
+        Distance reported for each trip, in meters.
+    trip_dimensions : numpy.ndarray
+        Array of shape (n, k) with the count dimensions each trip adds to,
+        -1 where a trip adds to none.
+    dimension_count : int
+        Number of count dimensions.
+    road_count : int
+        Number of roads in the GeoDataFrame the graph was built from.
+    progress : bool, optional
+        If True, shows a routing progress bar (default is False).
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (road_count, dimension_count) with trip counts per road.
+    """
+    # Route every distinct origin/destination pair once, sharing one search per origin.
+    # Road shape points that are not endpoints are contracted away before routing.
+    pairs: np.ndarray
+    pair_ids: np.ndarray
+    pairs, pair_ids = np.unique(np.column_stack((start_nodes, end_nodes)), axis=0, return_inverse=True)
+    pair_ids = pair_ids.ravel()
+    pair_distances: np.ndarray = np.full(len(pairs), np.nan)
+    pair_lines: List[np.ndarray] = [np.empty(0, dtype=np.int64)] * len(pairs)
+    routing_graph: RoadGraph = contract_graph(graph, pairs.ravel())
+
+    # Paths longer than the reported distance of every trip of a pair plus the tolerance are never accepted
+    with np.errstate(invalid='ignore'):
+        trip_cutoffs: np.ndarray = np.where(trip_distances < 0, np.inf,
+                                            trip_distances * (1 + DISTANCE_TOLERANCE) / HEURISTIC_SCALE)
+    pair_cutoffs: np.ndarray = np.full(len(pairs), -np.inf)
+    np.fmax.at(pair_cutoffs, pair_ids, trip_cutoffs)
+
+    paths: List[Optional[np.ndarray]] = route_batch(routing_graph, pairs[:, 0], pairs[:, 1], pair_cutoffs,
+                                                    progress=progress)
+    for pair_id, edges in enumerate(paths):
+        if edges is None:
+            continue
+        pair_lines[pair_id] = np.unique(routing_graph.edge_roads[edges])
+        pair_distances[pair_id] = calculate_distance_from_path(routing_graph, edges)
+
+    # Skip trips whose path distance differs from the reported one by more than 10%
+    with np.errstate(divide='ignore', invalid='ignore'):
+        accepted: np.ndarray = np.abs(pair_distances[pair_ids] - trip_distances) / trip_distances <= DISTANCE_TOLERANCE
+
+    # Count accepted trips per pair and dimension
+    pair_counts: np.ndarray = np.zeros((len(pairs), dimension_count), dtype=np.int32)
+    for dimensions in trip_dimensions.T:
+        counted: np.ndarray = accepted & (dimensions >= 0)
+        np.add.at(pair_counts, (pair_ids[counted], dimensions[counted]), 1)
+
+    # Scatter the pair counts to the roads along each used pair's path
+    used_pairs: np.ndarray = np.flatnonzero(pair_counts.any(axis=1))
+    line_roads: np.ndarray = np.concatenate([pair_lines[i] for i in used_pairs] + [np.empty(0, dtype=np.int64)])
+    line_pairs: np.ndarray = np.repeat(used_pairs, [len(pair_lines[i]) for i in used_pairs])
+    counts: np.ndarray = np.empty((road_count, dimension_count), dtype=np.int32)
+    for dimension in range(dimension_count):
+        counts[:, dimension] = np.bincount(line_roads, weights=pair_counts[line_pairs, dimension], minlength=road_count)
+    return counts
+
+
+def init_worker(graph: Union[RoadGraph, str]) -> None:
+    """
+    Stores the road graph in a worker process, so it is sent to each worker only once.
+
+    Parameters
+    ----------
+    graph : RoadGraph or str
+        Graph used by count_shard, or the directory of a compiled graph to load.
+    """
+    global worker_graph
+    worker_graph = load_graph(graph) if isinstance(graph, str) else graph
+
+
+def count_shard(shard: tuple) -> np.ndarray:
+    """
+    Counts the trips of one shard in a worker process.
+
+    Parameters
+    ----------
+    shard : tuple
+        Arguments of count_trips following the graph.
+
+    Returns
+    -------
+    numpy.ndarray
+        Trip counts per road, see count_trips.
+    """
+    return count_trips(worker_graph, *shard)
+
+
+def ensure_datasets(stream: bool = False, keep_csv: bool = False) -> None:
+    """
+    Downloads the trip CSV and road shapefile if any of them is missing. Trips
+    streamed into their cache without keeping the CSV count as present.
+
+    Parameters
+    ----------
+    stream : bool, optional
+        Parse the trips into their cache while downloading them, see
+        downloader.download_trips (default is False).
+    keep_csv : bool, optional
+        With stream, also save the raw trip CSV (default is False).
     """
-    # Download datasets if missing
     required_files: List[str] = ['illinois_highway.shp', 'illinois_highway.dbf', 'illinois_highway.prj',
-                                 'illinois_highway.shx', 'e_scooter_trips.csv']
-    if not all(os.path.exists(f) for f in required_files):
+                                 'illinois_highway.shx']
+    trips_present: bool = (os.path.exists('e_scooter_trips.csv') or
+                           cached_signature(cache_path('e_scooter_trips.csv')) is not None)
+    if not (trips_present and all(os.path.exists(f) for f in required_files)):
         print("Datasets not found. Downloading...")
-        downloader.download_datasets()
+        downloader.download_datasets(stream=stream, keep_csv=keep_csv or not stream)
+
+
+def count_road_trips(
+    trips_df: pd.DataFrame,
+    city_df: gpd.GeoDataFrame,
+    graph_directory: str,
+    project_to_edges: bool = False,
+    workers: int = 1,
+    trip_groups: Optional[np.ndarray] = None,
+    group_count: int = 1
+) -> Tuple[np.ndarray, List[str]]:
+    """
+    Snaps trips to the road network, routes them and counts trips by day type
+    and vendor on every road.
 
-    # Load and filter roads
-    margin: float = 0.1
-    city_df: gpd.GeoDataFrame = gpd.read_file('illinois_highway.shp')
-    city_df = filter_roads(city_df)
-    city_df[['count_work', 'count_free', 'count_lyft', 'count_lime', 'count_link']] = 0
-    city_df = city_df.cx[-87.89370076 - margin:-87.5349023379022 + margin,
-                         41.66013746994182 - margin:42.00962338 + margin].reset_index(drop=True)
+    Parameters
+    ----------
+    trips_df : pandas.DataFrame
+        Trip table with the trips to count.
+    city_df : geopandas.GeoDataFrame
+        Roads returned by load_road_network.
+    graph_directory : str
+        Directory of the compiled graph of the roads.
+    project_to_edges : bool, optional
+        If True, trips are routed between the projections of their endpoints
+        onto the closest roads (default is False), see map_trips_to_roads.
+    workers : int, optional
+        Number of worker processes used for routing (default is 1).
+    trip_groups : numpy.ndarray, optional
+        Group of every trip of trips_df, from 0 to group_count - 1. Every group
+        is counted separately (default puts all trips in group 0).
+    group_count : int, optional
+        Number of trip groups (default is 1).
 
-    g: nx.Graph = create_graph(city_df)
+    Returns
+    -------
+    counts : numpy.ndarray
+        Array of shape (group_count, roads, columns) with trip counts.
+    count_columns : list of str
+        Name of every count column.
+    """
+    graph: RoadGraph = load_graph(graph_directory)
+    if trip_groups is None:
+        trip_groups = np.zeros(len(trips_df), dtype=np.int64)
+
+    # Filter trips with missing coordinates and round trips
+    valid: np.ndarray = (trips_df[['start_latitude', 'start_longitude', 'end_latitude', 'end_longitude']].notna().all(axis=1) &
+                         ((trips_df['start_latitude'] != trips_df['end_latitude']) |
+                          (trips_df['start_longitude'] != trips_df['end_longitude']))).to_numpy()
+    trips_df = trips_df[valid]
+    trip_groups = trip_groups[valid]
+
+    start_lon: np.ndarray = trips_df['start_longitude'].to_numpy()
+    start_lat: np.ndarray = trips_df['start_latitude'].to_numpy()
+    end_lon: np.ndarray = trips_df['end_longitude'].to_numpy()
+    end_lat: np.ndarray = trips_df['end_latitude'].to_numpy()
+
+    if project_to_edges:
+        # Split the roads at the projections of the endpoints and route between them
+        start_roads: np.ndarray
+        end_roads: np.ndarray
+        road_index: STRtree = build_road_index(city_df)
+        start_roads, _ = snap_points(road_index, start_lon, start_lat)
+        end_roads, _ = snap_points(road_index, end_lon, end_lat)
+        start_edges, start_fractions = locate_on_edges(graph, city_df, start_roads, start_lon, start_lat)
+        end_edges, end_fractions = locate_on_edges(graph, city_df, end_roads, end_lon, end_lat)
+        graph, split_nodes = split_edges(graph, np.concatenate((start_edges, end_edges)),
+                                         np.concatenate((start_fractions, end_fractions)))
+        start_nodes, end_nodes = np.split(split_nodes, 2)
+    else:
+        # Route between the graph nodes closest to the endpoints
+        node_index: cKDTree = build_node_index(graph)
+        start_nodes = nearest_nodes(node_index, start_lon, start_lat)
+        end_nodes = nearest_nodes(node_index, end_lon, end_lat)
+
+    # Every trip adds to the count of its day type and of its vendor, within its group
+    vendor_names: List[str] = sorted(trips_df['vendor'].dropna().unique().tolist())
+    count_columns: List[str] = DAY_TYPE_COLUMNS + [count_column(vendor) for vendor in vendor_names]
+    vendor_codes: np.ndarray = pd.Categorical(trips_df['vendor'], categories=vendor_names).codes
+    trip_dimensions: np.ndarray = np.column_stack((
+        np.where(trips_df['start_time'].dt.weekday.to_numpy() >= 5, 1, 0),
+        np.where(vendor_codes >= 0, vendor_codes + len(DAY_TYPE_COLUMNS), -1),
+    ))
+    trip_dimensions = np.where(trip_dimensions >= 0, trip_dimensions + trip_groups[:, None] * len(count_columns), -1)
+    dimension_count: int = group_count * len(count_columns)
+    trip_distances: np.ndarray = trips_df['trip_distance'].to_numpy()
+
+    if workers > 1:
+        # Shard trips by origin, so every shortest path tree is grown in one worker only
+        origins: np.ndarray = np.unique(start_nodes, return_inverse=True)[1].ravel()
+        shard_ids: np.ndarray = origins % (workers * SHARDS_PER_WORKER)
+        shards: List[tuple] = [
+            (start_nodes[mask], end_nodes[mask], trip_distances[mask], trip_dimensions[mask],
+             dimension_count, len(city_df))
+            for mask in (shard_ids == shard for shard in np.unique(shard_ids))
+        ]
+        # Workers memory-map the compiled graph, unless it was split in memory
+        worker_source: Union[RoadGraph, str] = graph if project_to_edges else graph_directory
+        with ProcessPoolExecutor(workers, initializer=init_worker, initargs=(worker_source,)) as executor:
+            counts: np.ndarray = sum(tqdm(executor.map(count_shard, shards), total=len(shards)),
+                                     np.zeros((len(city_df), dimension_count), dtype=np.int32))
+    else:
+        counts = count_trips(graph, start_nodes, end_nodes, trip_distances, trip_dimensions,
+                             dimension_count, len(city_df), progress=True)
+    return counts.reshape(len(city_df), group_count, len(count_columns)).transpose(1, 0, 2), count_columns
+
+
+def day_digests(trips_df: pd.DataFrame, trip_days: np.ndarray, day_count: int, *parameters) -> List[str]:
+    """
+    Identifies the trips of every day by the content of their counted columns
+    and the parameters used to count them. Rows are hashed in the order of
+    their hashes, so reordering the trip table keeps the digests.
 
-    # Determine number of lines to process
-    number_of_lines: int = row_limits or sum(1 for _ in open(filename))
+    Parameters
+    ----------
+    trips_df : pandas.DataFrame
+        Trip table with the columns of COUNTED_COLUMNS.
+    trip_days : numpy.ndarray
+        Day of every trip, from 0 to day_count - 1, or -1 for trips outside the days.
+    day_count : int
+        Number of days.
+    *parameters
+        Counting parameters, e.g. version and distance tolerance.
+
+    Returns
+    -------
+    list of str
+        Hex digest of every day.
+    """
+    row_hashes: np.ndarray = pd.util.hash_pandas_object(trips_df[COUNTED_COLUMNS], index=False).to_numpy()
+    order: np.ndarray = np.lexsort((row_hashes, trip_days))
+    bounds: np.ndarray = np.searchsorted(trip_days[order], np.arange(day_count + 1))
+    digests: List[str] = []
+    for first, last in zip(bounds[:-1], bounds[1:]):
+        digest = hashlib.sha1(repr(parameters).encode())
+        digest.update(row_hashes[order[first:last]].tobytes())
+        digests.append(digest.hexdigest())
+    return digests
+
+
+def count_trips_by_day(
+    trips_df: pd.DataFrame,
+    city_df: gpd.GeoDataFrame,
+    graph_directory: str,
+    start: datetime,
+    end: datetime,
+    partition_dir: str,
+    project_to_edges: bool = False,
+    workers: int = 1
+) -> Tuple[np.ndarray, List[str]]:
+    """
+    Counts trips on every road from per-day partitions. Trips are assigned to
+    the day they start on, and the counts of every day are stored in
+    partition_dir with a digest of the day's trips and the counting parameters.
+    Days without a stored partition, or whose digest changed since it was
+    stored, are counted in one routing pass and stored. Partitions that cannot
+    be read, e.g. after an interrupted run, are counted again.
+    Trips starting before the range but ending inside it are always counted anew.
 
-    with open(filename, 'r') as file:
-        file.readline()  # skip header
-        for _ in tqdm(range(number_of_lines - 1)):
-            line: List[str] = list(file.readline().split(','))
+    Parameters
+    ----------
+    trips_df : pandas.DataFrame
+        Trip table restricted to trips overlapping the whole days from start to end.
+    city_df : geopandas.GeoDataFrame
+        Roads returned by load_road_network.
+    graph_directory : str
+        Directory of the compiled graph of the roads.
+    start : datetime
+        Start of the date range, counted from the beginning of its day.
+    end : datetime
+        End of the date range, counted to the end of its day.
+    partition_dir : str
+        Directory holding the per-day partitions.
+    project_to_edges : bool, optional
+        Snapping mode, see map_trips_to_roads (default is False).
+    workers : int, optional
+        Number of worker processes used for routing (default is 1).
 
-            # Parse times and skip invalid
+    Returns
+    -------
+    counts : numpy.ndarray
+        Array of shape (roads, columns) with trip counts.
+    count_columns : list of str
+        Name of every count column.
+    """
+    # Partitions depend on the road network and the snapping mode
+    network_dir: str = os.path.join(partition_dir, os.path.basename(graph_directory) +
+                                    ('_projected' if project_to_edges else ''))
+    os.makedirs(network_dir, exist_ok=True)
+
+    days: pd.DatetimeIndex = pd.date_range(pd.Timestamp(start).normalize(), pd.Timestamp(end).normalize(), freq='D')
+    trip_days: np.ndarray = days.get_indexer(trips_df['start_time'].dt.normalize())
+    digests: List[str] = day_digests(trips_df, trip_days, len(days), COUNTING_VERSION, DISTANCE_TOLERANCE,
+                                     project_to_edges)
+
+    partitions: List[Tuple[np.ndarray, List[str]]] = []
+    missing_days: List[int] = []
+    for i, day in enumerate(days):
+        partition_file: str = os.path.join(network_dir, f"{day:%Y-%m-%d}.npz")
+        if os.path.exists(partition_file):
             try:
-                start_time: datetime = datetime.strptime(line[1], "%m/%d/%Y %I:%M:%S %p")
-                end_time: datetime = datetime.strptime(line[2], "%m/%d/%Y %I:%M:%S %p")
-            except ValueError:
-                continue
-
-            # Filter trips outside date range
-            if not start <= start_time <= end and not start <= end_time <= end:
-                continue
-
-            trip_distance: float = float(line[3])
-            vendor: str = line[5]
-
-            # Skip trips with missing coordinates
-            if line[10] == '' or line[11] == '' or line[13] == '' or line[14] == '':
-                continue
-
-            start_lat: float = float(line[10])
-            start_lon: float = float(line[11])
-            end_lat: float = float(line[13])
-            end_lon: float = float(line[14])
-
-            if start_lat == end_lat and start_lon == end_lon:
-                continue
-
-            start_point: Point = Point(start_lon, start_lat)
-            end_point: Point = Point(end_lon, end_lat)
-
-            start_line: LineString = closest_line(city_df['geometry'], start_point)
-            end_line: LineString = closest_line(city_df['geometry'], end_point)
-
-            start_points: List[Tuple[float, float]] = list(start_line.coords)
-            end_points: List[Tuple[float, float]] = list(end_line.coords)
-
-            shortest_path: List[Tuple[float, float]]
-            line_indices: List[int]
-            shortest_path, line_indices = get_shortest_path_lines(start_points[0], end_points[0], g)
-            shortest_path_distance: float = calculate_distance_from_path(shortest_path)
-
-            # Skip if distance error > 10%
-            if abs(shortest_path_distance - trip_distance) / trip_distance > 0.1:
-                continue
-
-            # Update counts by weekday/weekend
-            if start_time.weekday() < 5:
-                city_df.loc[line_indices, 'count_work'] += 1
-            else:
-                city_df.loc[line_indices, 'count_free'] += 1
-
-            # Update counts by vendor
-            if vendor == "Lime":
-                city_df.loc[line_indices, 'count_lime'] += 1
-            if vendor == "Lyft":
-                city_df.loc[line_indices, 'count_lyft'] += 1
-            if vendor == "Link":
-                city_df.loc[line_indices, 'count_link'] += 1
+                with np.load(partition_file) as partition:
+                    if 'digest' in partition.files and str(partition['digest']) == digests[i]:
+                        partitions.append((partition['counts'], partition['columns'].tolist()))
+                        continue
+            except (zipfile.BadZipFile, OSError, ValueError, EOFError):
+                # A partition that cannot be read is counted again
+                pass
+        missing_days.append(i)
+
+    if missing_days:
+        print(f"Counting {len(missing_days)} of {len(days)} days...")
+        group_ids: np.ndarray = np.full(len(days), -1)
+        group_ids[missing_days] = np.arange(len(missing_days))
+        missing: np.ndarray = trip_days >= 0
+        missing[missing] = group_ids[trip_days[missing]] >= 0
+        day_counts, day_columns = count_road_trips(trips_df[missing], city_df, graph_directory, project_to_edges,
+                                                   workers, group_ids[trip_days[missing]], len(missing_days))
+        for group, i in enumerate(missing_days):
+            # Partitions only appear under their name once written completely
+            temporary_file: str = os.path.join(network_dir, f"{days[i]:%Y-%m-%d}.tmp.npz")
+            np.savez(temporary_file, counts=day_counts[group], columns=np.array(day_columns), digest=digests[i])
+            os.replace(temporary_file, os.path.join(network_dir, f"{days[i]:%Y-%m-%d}.npz"))
+            partitions.append((day_counts[group], day_columns))
+
+    # Trips started before the range are not part of any of its days
+    earlier: np.ndarray = trip_days < 0
+    if earlier.any():
+        earlier_counts, earlier_columns = count_road_trips(trips_df[earlier], city_df, graph_directory,
+                                                           project_to_edges, workers)
+        partitions.append((earlier_counts[0], earlier_columns))
+
+    # Sum the partitions, matching their columns by name
+    vendor_columns: set = {column for _, columns in partitions for column in columns} - set(DAY_TYPE_COLUMNS)
+    count_columns: List[str] = DAY_TYPE_COLUMNS + sorted(vendor_columns)
+    counts: np.ndarray = np.zeros((len(city_df), len(count_columns)), dtype=np.int32)
+    for partition_counts, columns in partitions:
+        counts[:, [count_columns.index(column) for column in columns]] += partition_counts
+    return counts, count_columns
+
+
+def map_trips_to_roads(
+    trips_df: pd.DataFrame,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    project_to_edges: bool = False,
+    workers: int = 1,
+    landmarks: int = 0,
+    partition_dir: Optional[str] = None
+) -> None:
+    """
+    Maps trips from the trip table to the road network, counts trips by type
+    and vendor, and saves results as a shapefile.
+
+    Parameters
+    ----------
+    trips_df : pandas.DataFrame
+        Trip table returned by trip_loader.load_trips.
+    start : datetime, optional
+        Start date for filtering trips.
+    end : datetime, optional
+        End date for filtering trips.
+    project_to_edges : bool, optional
+        If True, trips are routed between the projections of their endpoints
+        onto the closest roads, which split the road edges they fall on, instead
+        of the closest graph nodes (default is False).
+    workers : int, optional
+        Number of worker processes used for routing (default is 1).
+    landmarks : int, optional
+        Number of A* landmarks to precompute for the road network, see
+        load_road_network (default is 0).
+    partition_dir : str, optional
+        If given, counts are kept as per-day partitions in this directory and
+        only days without a partition are routed, see count_trips_by_day. The
+        range is then extended to whole days.
+
+    Returns
+    -------
+    None
+        Saves the updated GeoDataFrame with trip counts as a shapefile.
+    """
+    # Load the filtered roads and their compiled graph
+    city_df: gpd.GeoDataFrame
+    graph_directory: str
+    city_df, graph_directory = load_road_network(landmarks=landmarks)
+
+    counts: np.ndarray
+    count_columns: List[str]
+    if partition_dir is None:
+        trips_df = select_date_range(trips_df, start, end)
+        counts, count_columns = count_road_trips(trips_df, city_df, graph_directory, project_to_edges, workers)
+        counts = counts[0]
+    else:
+        # Partitions cover whole days
+        if start is None:
+            start = trips_df['start_time'].min()
+        if end is None:
+            end = trips_df['end_time'].max()
+        start = pd.Timestamp(start).normalize().to_pydatetime()
+        end = (pd.Timestamp(end).normalize() + pd.Timedelta(days=1, microseconds=-1)).to_pydatetime()
+        trips_df = select_date_range(trips_df, start, end)
+        counts, count_columns = count_trips_by_day(trips_df, city_df, graph_directory, start, end, partition_dir,
+                                                   project_to_edges, workers)
+    city_df = city_df.assign(**dict(zip(count_columns, counts.T)))
 
     # Save updated GeoDataFrame
     city_df.to_file(f"{start.strftime('%d-%m-%Y')}_{end.strftime('%d-%m-%Y')}.shp")
 
 
 if __name__ == '__main__':
-    csv_file: str = sys.argv[1]
-    start_day: str = sys.argv[2]
-    end_day: str = sys.argv[3]
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(description="E-scooter trip analysis for Chicago.")
+    parser.add_argument('csv_file', help="CSV file containing e-scooter trips.")
+    parser.add_argument('start_day', help="Start date (dd/mm/yyyy).")
+    parser.add_argument('end_day', help="End date (dd/mm/yyyy).")
+    parser.add_argument('--workers', type=int, default=1, help="Number of worker processes used for routing.")
+    parser.add_argument('--landmarks', type=int, default=0,
+                        help="Number of A* landmarks to precompute and store with the road network.")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Keep per-day road counts in daily_counts/ and only process days not counted yet.")
+    parser.add_argument('--raster-trajectories', action='store_true',
+                        help="Accumulate trajectories into an image instead of drawing every route as a line.")
+    parser.add_argument('--grid', choices=['square', 'hex'], default='square',
+                        help="Cell shape used to bin trip starts and ends.")
+    parser.add_argument('--cell-size', type=float, default=250.0,
+                        help="Distance between the centers of neighbouring start/end map cells in meters.")
+    parser.add_argument('--tiles', action='store_true',
+                        help="Also render the road counts as XYZ map tiles.")
+    parser.add_argument('--max-zoom', type=int, default=14, help="Highest zoom level of the map tiles.")
+    parser.add_argument('--stream', action='store_true',
+                        help="Parse the trip CSV into its cache while downloading it, without saving the CSV.")
+    parser.add_argument('--keep-csv', action='store_true', help="With --stream, also save the raw trip CSV.")
+    args: argparse.Namespace = parser.parse_args()
+
+    csv_file: str = args.csv_file
+    start_day: str = args.start_day
+    end_day: str = args.end_day
 
     result_shapefile_path: str = f"{start_day.replace('/', '-')}_{end_day.replace('/', '-')}.shp"
     start_date: datetime = datetime.strptime(f"{start_day} 00:00:00", "%d/%m/%Y %H:%M:%S")
     end_date: datetime = datetime.strptime(f"{end_day} 23:59:59", "%d/%m/%Y %H:%M:%S")
 
+    # Parse trips once and share the table between all stages
+    ensure_datasets(stream=args.stream, keep_csv=args.keep_csv)
+    trips: pd.DataFrame = load_trips(csv_file, start=start_date, end=end_date)
+
     # Process trips and generate shapefile
-    read_trips_file(csv_file, start=start_date, end=end_date)
+    map_trips_to_roads(trips, start=start_date, end=end_date, workers=args.workers, landmarks=args.landmarks,
+                       partition_dir='daily_counts' if args.incremental else None)
 
     # Generate maps and charts
-    create_heat_map(result_shapefile_path)
-    create_bar_chart(csv_file, start_day, end_day)
-    create_line_chart(csv_file, start_day, end_day)
-    create_start_end_map(csv_file, start_day, end_day)
-    create_trajectory_map(csv_file, start_day, end_day, result_shapefile_path)
+    create_heat_map(result_shapefile_path, workers=args.workers)
+    if args.tiles:
+        create_tile_pyramid(result_shapefile_path, f"{result_shapefile_path[:-4]}_tiles", max_zoom=args.max_zoom,
+                            workers=args.workers)
+    create_bar_chart(trips, start_day, end_day)
+    create_line_chart(trips, start_day, end_day)
+    create_start_end_map(trips, start_day, end_day, result_shapefile_path, cell_size=args.cell_size, grid=args.grid)
+    create_trajectory_map(trips, start_day, end_day, result_shapefile_path, raster=args.raster_trajectories)
@@ -0,0 +1,499 @@
+from dataclasses import dataclass, field
+import hashlib
+import json
+import os
+import geopandas as gpd
+import numpy as np
+import shapely
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+from typing import Optional, Tuple
+
+# Mean Earth radius in meters
+EARTH_RADIUS: float = 6_371_008.8
+
+# Reference latitude for the local planar approximation of Chicago coordinates
+REFERENCE_LATITUDE: float = 41.85
+
+# Arrays stored in a compiled graph directory
+GRAPH_ARRAYS: Tuple[str, ...] = ('nodes', 'edge_nodes', 'edge_weights', 'edge_roads', 'indptr', 'neighbors', 'slot_edges')
+
+
+@dataclass
+class RoadGraph:
+    """
+    Undirected road graph stored as flat arrays. Nodes are integer ids and
+    the adjacency of every node is kept in compressed sparse row (CSR) form.
+
+    Attributes
+    ----------
+    nodes : numpy.ndarray
+        Array of shape (n, 2) with node coordinates (longitude, latitude).
+    edge_nodes : numpy.ndarray
+        Array of shape (m, 2) with the end nodes of every edge.
+    edge_weights : numpy.ndarray
+        Length of every edge in meters.
+    edge_roads : numpy.ndarray
+        Row index of the road in the GeoDataFrame each edge belongs to.
+    indptr : numpy.ndarray
+        Array of shape (n + 1,). The adjacency of node i is stored in slots
+        indptr[i] to indptr[i + 1] of neighbors and slot_edges.
+    neighbors : numpy.ndarray
+        Node at the other end of every adjacency slot.
+    slot_edges : numpy.ndarray
+        Edge id of every adjacency slot.
+    landmark_distances : numpy.ndarray, optional
+        Array of shape (k, n) with the path distance from each of k landmarks
+        to every node, 0 where a node cannot be reached. Used by A* search.
+    """
+    nodes: np.ndarray
+    edge_nodes: np.ndarray
+    edge_weights: np.ndarray
+    edge_roads: np.ndarray
+    indptr: np.ndarray
+    neighbors: np.ndarray
+    slot_edges: np.ndarray
+    landmark_distances: Optional[np.ndarray] = None
+    _adjacency: Optional[tuple] = field(default=None, init=False, repr=False, compare=False)
+
+    def adjacency(self) -> tuple:
+        """
+        Returns the graph as plain Python lists for fast scalar access in search loops.
+
+        Returns
+        -------
+        tuple
+            indptr, neighbors, slot_edges and slot_weights lists, followed by the
+            longitude, latitude and cosine of latitude of every node in radians
+            and the list of node distances of every landmark.
+        """
+        if self._adjacency is None:
+            longitudes: np.ndarray = np.radians(self.nodes[:, 0])
+            latitudes: np.ndarray = np.radians(self.nodes[:, 1])
+            self._adjacency = (
+                self.indptr.tolist(),
+                self.neighbors.tolist(),
+                self.slot_edges.tolist(),
+                self.edge_weights[self.slot_edges].tolist(),
+                longitudes.tolist(),
+                latitudes.tolist(),
+                np.cos(latitudes).tolist(),
+                [] if self.landmark_distances is None else self.landmark_distances.tolist(),
+            )
+        return self._adjacency
+
+
+def haversine(longitudes_1: np.ndarray, latitudes_1: np.ndarray,
+              longitudes_2: np.ndarray, latitudes_2: np.ndarray) -> np.ndarray:
+    """
+    Calculates great-circle distances between pairs of points.
+
+    Parameters
+    ----------
+    longitudes_1, latitudes_1 : numpy.ndarray
+        Coordinates of the first points in degrees.
+    longitudes_2, latitudes_2 : numpy.ndarray
+        Coordinates of the second points in degrees.
+
+    Returns
+    -------
+    numpy.ndarray
+        Distances in meters.
+    """
+    lon_1, lat_1, lon_2, lat_2 = map(np.radians, (longitudes_1, latitudes_1, longitudes_2, latitudes_2))
+    a: np.ndarray = np.sin((lat_2 - lat_1) / 2) ** 2 + np.cos(lat_1) * np.cos(lat_2) * np.sin((lon_2 - lon_1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def from_edges(nodes: np.ndarray, edge_nodes: np.ndarray, edge_weights: np.ndarray, edge_roads: np.ndarray) -> RoadGraph:
+    """
+    Builds the CSR adjacency of an undirected graph from its edge list.
+
+    Parameters
+    ----------
+    nodes : numpy.ndarray
+        Array of shape (n, 2) with node coordinates.
+    edge_nodes : numpy.ndarray
+        Array of shape (m, 2) with the end nodes of every edge.
+    edge_weights : numpy.ndarray
+        Length of every edge in meters.
+    edge_roads : numpy.ndarray
+        Road row index of every edge.
+
+    Returns
+    -------
+    RoadGraph
+        Graph with edges stored in both directions.
+    """
+    edge_ids: np.ndarray = np.arange(len(edge_nodes))
+    tails: np.ndarray = np.concatenate((edge_nodes[:, 0], edge_nodes[:, 1]))
+    heads: np.ndarray = np.concatenate((edge_nodes[:, 1], edge_nodes[:, 0]))
+    order: np.ndarray = np.argsort(tails, kind='stable')
+
+    indptr: np.ndarray = np.zeros(len(nodes) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum(np.bincount(tails, minlength=len(nodes)))
+    return RoadGraph(
+        nodes=nodes,
+        edge_nodes=edge_nodes,
+        edge_weights=edge_weights,
+        edge_roads=edge_roads,
+        indptr=indptr,
+        neighbors=heads[order],
+        slot_edges=np.concatenate((edge_ids, edge_ids))[order],
+    )
+
+
+def create_graph(df: gpd.GeoDataFrame) -> RoadGraph:
+    """
+    Creates a road graph from a GeoDataFrame of line geometries. Vertices
+    with equal coordinates become one node and every line segment becomes an
+    edge, so edges of a road are numbered in the order of its vertices.
+
+    Parameters
+    ----------
+    df : geopandas.GeoDataFrame
+        GeoDataFrame containing line geometries in 'geometry' column.
+
+    Returns
+    -------
+    RoadGraph
+        A graph where nodes are coordinates and edges represent line segments.
+    """
+    coords: np.ndarray
+    road_rows: np.ndarray
+    coords, road_rows = shapely.get_coordinates(df.geometry.to_numpy(), return_index=True)
+    nodes: np.ndarray
+    node_ids: np.ndarray
+    nodes, node_ids = np.unique(coords, axis=0, return_inverse=True)
+    node_ids = node_ids.ravel()
+
+    # Consecutive vertices of the same road form a segment
+    same_road: np.ndarray = road_rows[1:] == road_rows[:-1]
+    edge_nodes: np.ndarray = np.column_stack((node_ids[:-1][same_road], node_ids[1:][same_road]))
+    edge_weights: np.ndarray = haversine(nodes[edge_nodes[:, 0], 0], nodes[edge_nodes[:, 0], 1],
+                                         nodes[edge_nodes[:, 1], 0], nodes[edge_nodes[:, 1], 1])
+    return from_edges(nodes, edge_nodes, edge_weights, road_rows[:-1][same_road])
+
+
+def contract_graph(graph: RoadGraph, protected_nodes: np.ndarray) -> RoadGraph:
+    """
+    Contracts chains of degree-2 nodes into single edges. Only nodes joining two
+    consecutive segments of the same road are contracted, so every edge of the
+    result still belongs to exactly one road and path lengths are unchanged.
+
+    Parameters
+    ----------
+    graph : RoadGraph
+        Graph created by create_graph.
+    protected_nodes : numpy.ndarray
+        Ids of nodes that must stay in the graph, e.g. trip endpoints.
+
+    Returns
+    -------
+    RoadGraph
+        Graph over the same node ids. Contracted nodes are left without edges.
+    """
+    if len(graph.edge_nodes) == 0:
+        return graph
+    protected: np.ndarray = np.zeros(len(graph.nodes), dtype=bool)
+    protected[protected_nodes] = True
+
+    # Node shared by every pair of consecutive segments of the same road
+    joints: np.ndarray = graph.edge_nodes[:-1, 1]
+    contracted: np.ndarray = ((graph.edge_roads[1:] == graph.edge_roads[:-1]) &
+                              (graph.edge_nodes[1:, 0] == joints) &
+                              (np.diff(graph.indptr)[joints] == 2) &
+                              ~protected[joints])
+
+    # Every chain is a run of segments linked by contracted joints
+    starts: np.ndarray = np.flatnonzero(np.r_[True, ~contracted])
+    ends: np.ndarray = np.r_[starts[1:], len(graph.edge_nodes)] - 1
+    contracted_graph: RoadGraph = from_edges(
+        graph.nodes,
+        np.column_stack((graph.edge_nodes[starts, 0], graph.edge_nodes[ends, 1])),
+        np.add.reduceat(graph.edge_weights, starts),
+        graph.edge_roads[starts],
+    )
+    # Distances between the remaining nodes do not change, so landmarks stay valid
+    contracted_graph.landmark_distances = graph.landmark_distances
+    return contracted_graph
+
+
+def component_labels(graph: RoadGraph) -> np.ndarray:
+    """
+    Labels the connected components of a graph. Two nodes are connected by a
+    path only if they have the same label.
+
+    Parameters
+    ----------
+    graph : RoadGraph
+        Graph to label.
+
+    Returns
+    -------
+    numpy.ndarray
+        Component label of every node.
+    """
+    adjacency: csr_matrix = csr_matrix((np.ones(len(graph.neighbors), dtype=np.int8), graph.neighbors, graph.indptr),
+                                       shape=(len(graph.nodes), len(graph.nodes)))
+    return connected_components(adjacency, directed=False)[1]
+
+
+def network_key(shapefile: str, *parameters) -> str:
+    """
+    Identifies a road network version by the content of its shapefile and the
+    parameters used to cut it, e.g. road types and bounding box.
+
+    Parameters
+    ----------
+    shapefile : str
+        Path to the road shapefile.
+    *parameters
+        JSON-serializable values the network depends on.
+
+    Returns
+    -------
+    str
+        Hexadecimal key.
+    """
+    digest = hashlib.sha1()
+    for extension in ('.shp', '.dbf'):
+        with open(os.path.splitext(shapefile)[0] + extension, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+    digest.update(json.dumps(parameters).encode())
+    return digest.hexdigest()[:16]
+
+
+def save_graph(graph: RoadGraph, directory: str) -> None:
+    """
+    Writes the graph arrays to a directory as NumPy files.
+
+    Parameters
+    ----------
+    graph : RoadGraph
+        Graph to save.
+    directory : str
+        Directory to write to, created if missing.
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name in GRAPH_ARRAYS:
+        np.save(os.path.join(directory, f"{name}.npy"), getattr(graph, name))
+
+    # Metadata is written last, so an interrupted write leaves no valid graph
+    with open(os.path.join(directory, 'meta.json'), 'w') as file:
+        json.dump({'nodes': len(graph.nodes), 'edges': len(graph.edge_nodes)}, file)
+
+
+def load_graph(directory: str) -> Optional[RoadGraph]:
+    """
+    Loads a graph saved with save_graph, with the landmarks saved by
+    save_landmarks if there are any. The arrays are memory-mapped, so
+    processes loading the same graph share its pages.
+
+    Parameters
+    ----------
+    directory : str
+        Directory written by save_graph.
+
+    Returns
+    -------
+    RoadGraph or None
+        Loaded graph, or None if the directory holds no complete graph.
+    """
+    if not os.path.exists(os.path.join(directory, 'meta.json')):
+        return None
+    graph: RoadGraph = RoadGraph(**{name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r')
+                                    for name in GRAPH_ARRAYS})
+    landmarks_file: str = os.path.join(directory, 'landmarks.npy')
+    if os.path.exists(landmarks_file):
+        graph.landmark_distances = np.load(landmarks_file, mmap_mode='r')
+    return graph
+
+
+def save_landmarks(landmark_distances: np.ndarray, directory: str) -> None:
+    """
+    Stores landmark distances next to a graph saved with save_graph, replacing
+    any landmarks saved before. load_graph attaches them to the loaded graph.
+
+    Parameters
+    ----------
+    landmark_distances : numpy.ndarray
+        Distances computed by routing.compute_landmarks.
+    directory : str
+        Directory written by save_graph.
+    """
+    # Loaded landmarks may be memory-mapped, so the file is replaced instead of overwritten
+    temporary_file: str = os.path.join(directory, 'landmarks.tmp.npy')
+    np.save(temporary_file, landmark_distances)
+    os.replace(temporary_file, os.path.join(directory, 'landmarks.npy'))
+
+
+def to_planar(longitudes: np.ndarray, latitudes: np.ndarray) -> np.ndarray:
+    """
+    Projects coordinates onto a local plane where both axes have the same scale.
+
+    Parameters
+    ----------
+    longitudes : numpy.ndarray
+        Longitudes of the points.
+    latitudes : numpy.ndarray
+        Latitudes of the points.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (n, 2) with planar coordinates in latitude degrees.
+    """
+    return np.column_stack((np.asarray(longitudes) * np.cos(np.radians(REFERENCE_LATITUDE)), latitudes))
+
+
+def build_node_index(graph: RoadGraph) -> cKDTree:
+    """
+    Builds a KD-tree over all nodes of the graph.
+
+    Parameters
+    ----------
+    graph : RoadGraph
+        Graph created by create_graph.
+
+    Returns
+    -------
+    scipy.spatial.cKDTree
+        KD-tree over the planar node coordinates, in node id order.
+    """
+    return cKDTree(to_planar(graph.nodes[:, 0], graph.nodes[:, 1]))
+
+
+def nearest_nodes(node_index: cKDTree, longitudes: np.ndarray, latitudes: np.ndarray) -> np.ndarray:
+    """
+    Finds the closest graph node for every point of a batch.
+
+    Parameters
+    ----------
+    node_index : scipy.spatial.cKDTree
+        KD-tree built by build_node_index.
+    longitudes : numpy.ndarray
+        Longitudes of the points.
+    latitudes : numpy.ndarray
+        Latitudes of the points.
+
+    Returns
+    -------
+    numpy.ndarray
+        Id of the closest node to each point.
+    """
+    node_ids: np.ndarray
+    _, node_ids = node_index.query(to_planar(longitudes, latitudes))
+    return node_ids
+
+
+def locate_on_edges(
+    graph: RoadGraph,
+    df: gpd.GeoDataFrame,
+    road_indices: np.ndarray,
+    longitudes: np.ndarray,
+    latitudes: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Projects points onto their snapped roads and finds the edge holding each projection.
+
+    Parameters
+    ----------
+    graph : RoadGraph
+        Graph created by create_graph from the same GeoDataFrame.
+    df : geopandas.GeoDataFrame
+        GeoDataFrame containing line geometries in 'geometry' column.
+    road_indices : numpy.ndarray
+        Row index of the road each point is snapped to.
+    longitudes : numpy.ndarray
+        Longitudes of the points.
+    latitudes : numpy.ndarray
+        Latitudes of the points.
+
+    Returns
+    -------
+    edges : numpy.ndarray
+        Id of the edge holding each projection.
+    fractions : numpy.ndarray
+        Position of each projection along its edge, from 0 at the first
+        end node to 1 at the second.
+    """
+    lines: np.ndarray = df.geometry.to_numpy()[road_indices]
+    offsets: np.ndarray = shapely.line_locate_point(lines, shapely.points(longitudes, latitudes))
+    first_edges: np.ndarray = np.searchsorted(graph.edge_roads, road_indices)
+
+    edges: np.ndarray = np.empty(len(lines), dtype=np.int64)
+    fractions: np.ndarray = np.empty(len(lines))
+    for i, (line, offset) in enumerate(zip(lines, offsets)):
+        coords: np.ndarray = shapely.get_coordinates(line)
+        boundaries: np.ndarray = np.concatenate(([0.0], np.cumsum(np.hypot(*np.diff(coords, axis=0).T))))
+        segment: int = int(np.clip(np.searchsorted(boundaries, offset, side='right') - 1, 0, len(boundaries) - 2))
+        length: float = boundaries[segment + 1] - boundaries[segment]
+        edges[i] = first_edges[i] + segment
+        fractions[i] = (offset - boundaries[segment]) / length if length > 0 else 0.0
+    return edges, fractions
+
+
+def split_edges(graph: RoadGraph, edges: np.ndarray, fractions: np.ndarray) -> Tuple[RoadGraph, np.ndarray]:
+    """
+    Virtually splits edges at the given positions. Every distinct split point
+    becomes a new node and its edge is replaced by a chain of shorter edges
+    belonging to the same road.
+
+    Parameters
+    ----------
+    graph : RoadGraph
+        Graph to split.
+    edges : numpy.ndarray
+        Id of the edge holding each point.
+    fractions : numpy.ndarray
+        Position of each point along its edge, see locate_on_edges.
+
+    Returns
+    -------
+    graph : RoadGraph
+        Graph with the split points as nodes. The input graph is not modified.
+    node_ids : numpy.ndarray
+        Node id of each point in the returned graph.
+    """
+    fractions = np.clip(fractions, 0.0, 1.0)
+    node_ids: np.ndarray = np.where(fractions < 0.5, graph.edge_nodes[edges, 0], graph.edge_nodes[edges, 1])
+    inner: np.ndarray = (fractions > 0.0) & (fractions < 1.0)
+    if not inner.any():
+        return graph, node_ids
+
+    # Distinct split points sorted by edge, then by position along the edge
+    splits: np.ndarray
+    inverse: np.ndarray
+    splits, inverse = np.unique(np.column_stack((edges[inner], fractions[inner])), axis=0, return_inverse=True)
+    split_edge_ids: np.ndarray = splits[:, 0].astype(np.int64)
+    split_fractions: np.ndarray = splits[:, 1]
+    new_nodes: np.ndarray = len(graph.nodes) + np.arange(len(splits))
+    node_ids[inner] = new_nodes[inverse.ravel()]
+
+    u: np.ndarray = graph.edge_nodes[split_edge_ids, 0]
+    v: np.ndarray = graph.edge_nodes[split_edge_ids, 1]
+    coords: np.ndarray = graph.nodes[u] + split_fractions[:, None] * (graph.nodes[v] - graph.nodes[u])
+
+    # Each split point is linked to the previous point on its edge, the last one also to v
+    first: np.ndarray = np.r_[True, split_edge_ids[1:] != split_edge_ids[:-1]]
+    last: np.ndarray = np.r_[split_edge_ids[1:] != split_edge_ids[:-1], True]
+    previous_nodes: np.ndarray = np.where(first, u, new_nodes - 1)
+    previous_fractions: np.ndarray = np.where(first, 0.0, np.r_[0.0, split_fractions[:-1]])
+    weights: np.ndarray = graph.edge_weights[split_edge_ids]
+    roads: np.ndarray = graph.edge_roads[split_edge_ids]
+
+    kept: np.ndarray = np.ones(len(graph.edge_nodes), dtype=bool)
+    kept[split_edge_ids] = False
+    return from_edges(
+        np.concatenate((graph.nodes, coords)),
+        np.concatenate((graph.edge_nodes[kept],
+                        np.column_stack((previous_nodes, new_nodes)),
+                        np.column_stack((new_nodes[last], v[last])))),
+        np.concatenate((graph.edge_weights[kept],
+                        weights * (split_fractions - previous_fractions),
+                        weights[last] * (1.0 - split_fractions[last]))),
+        np.concatenate((graph.edge_roads[kept], roads, roads[last])),
+    ), node_ids
@@ -0,0 +1,280 @@
+from heapq import heappop, heappush
+from math import asin, inf, sin, sqrt
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+from tqdm import tqdm
+from typing import Iterable, List, Optional
+
+from road_graph import EARTH_RADIUS, RoadGraph, component_labels, haversine
+
+# Scales the heuristic slightly down, so rounding never makes it overestimate
+HEURISTIC_SCALE: float = 1 - 1e-9
+
+
+def astar(graph: RoadGraph, source: int, target: int, cutoff: float = inf) -> Optional[np.ndarray]:
+    """
+    Finds the shortest path between two nodes with A* search. The heuristic is
+    the great-circle distance to the target, which never exceeds the length
+    of a path made of edges weighted with their great-circle length. If the
+    graph has landmarks, the heuristic is raised to the largest landmark
+    bound (ALT), see compute_landmarks.
+
+    Parameters
+    ----------
+    graph : RoadGraph
+        Graph created by road_graph.create_graph.
+    source : int
+        Id of the start node.
+    target : int
+        Id of the end node.
+    cutoff : float, optional
+        Maximum path length in meters. The search stops as soon as no path
+        within it is left (default is no limit).
+
+    Returns
+    -------
+    numpy.ndarray or None
+        Ids of the edges along the path, in order from source to target,
+        or None if the target cannot be reached within the cutoff.
+    """
+    indptr, neighbors, slot_edges, slot_weights, longitudes, latitudes, cos_latitudes, landmarks = graph.adjacency()
+    target_longitude: float = longitudes[target]
+    target_latitude: float = latitudes[target]
+    target_cos: float = cos_latitudes[target]
+    target_landmarks: list = [(distances, distances[target]) for distances in landmarks]
+    scale: float = 2 * EARTH_RADIUS * HEURISTIC_SCALE
+
+    def heuristic(node: int) -> float:
+        a: float = (sin((latitudes[node] - target_latitude) / 2) ** 2 +
+                    cos_latitudes[node] * target_cos * sin((longitudes[node] - target_longitude) / 2) ** 2)
+        estimate: float = scale * asin(sqrt(min(a, 1.0)))
+        # By the triangle inequality, the path is at least as long as any landmark distance difference
+        for distances, target_distance in target_landmarks:
+            bound: float = abs(distances[node] - target_distance) * HEURISTIC_SCALE
+            if bound > estimate:
+                estimate = bound
+        return estimate
+
+    distances: dict = {source: 0.0}
+    predecessors: dict = {}
+    heap: list = [(heuristic(source), 0.0, source)]
+    while heap:
+        estimate, distance, node = heappop(heap)
+        if estimate > cutoff:
+            return None
+        if node == target:
+            break
+        if distance > distances[node]:
+            continue
+        for slot in range(indptr[node], indptr[node + 1]):
+            neighbor: int = neighbors[slot]
+            new_distance: float = distance + slot_weights[slot]
+            if new_distance < distances.get(neighbor, inf):
+                distances[neighbor] = new_distance
+                predecessors[neighbor] = (node, slot_edges[slot])
+                heappush(heap, (new_distance + heuristic(neighbor), new_distance, neighbor))
+    else:
+        return None
+    return trace_path(predecessors, source, target)
+
+
+def shortest_path_tree(graph: RoadGraph, source: int, targets: Iterable[int], cutoff: float = inf) -> dict:
+    """
+    Grows a shortest path tree from a source with Dijkstra's algorithm. The
+    search stops as soon as every target is settled or the cutoff is passed.
+
+    Parameters
+    ----------
+    graph : RoadGraph
+        Graph created by road_graph.create_graph.
+    source : int
+        Id of the root node.
+    targets : iterable of int
+        Ids of the nodes the tree has to reach.
+    cutoff : float, optional
+        Maximum path length in meters (default is no limit).
+
+    Returns
+    -------
+    dict
+        Predecessor map of the tree, from node id to a (previous node, edge id) pair.
+        Paths are read from it with trace_path. Targets not settled within the
+        cutoff are left out.
+    """
+    indptr, neighbors, slot_edges, slot_weights = graph.adjacency()[:4]
+    remaining: set = set(targets)
+    remaining.discard(source)
+
+    distances: dict = {source: 0.0}
+    predecessors: dict = {}
+    heap: list = [(0.0, source)]
+    while heap and remaining:
+        distance, node = heappop(heap)
+        if distance > cutoff:
+            break
+        if distance > distances[node]:
+            continue
+        remaining.discard(node)
+        for slot in range(indptr[node], indptr[node + 1]):
+            neighbor: int = neighbors[slot]
+            new_distance: float = distance + slot_weights[slot]
+            if new_distance < distances.get(neighbor, inf):
+                distances[neighbor] = new_distance
+                predecessors[neighbor] = (node, slot_edges[slot])
+                heappush(heap, (new_distance, neighbor))
+
+    # Unsettled targets may only have a tentative path
+    for target in remaining:
+        predecessors.pop(target, None)
+    return predecessors
+
+
+def trace_path(predecessors: dict, source: int, target: int) -> Optional[np.ndarray]:
+    """
+    Reads the path to a target from a predecessor map.
+
+    Parameters
+    ----------
+    predecessors : dict
+        Map from node id to a (previous node, edge id) pair.
+    source : int
+        Id of the start node.
+    target : int
+        Id of the end node.
+
+    Returns
+    -------
+    numpy.ndarray or None
+        Ids of the edges along the path, in order from source to target,
+        or None if the target was not reached.
+    """
+    if target != source and target not in predecessors:
+        return None
+    edges: List[int] = []
+    node: int = target
+    while node != source:
+        node, edge = predecessors[node]
+        edges.append(edge)
+    return np.array(edges[::-1], dtype=np.int64)
+
+
+def route_batch(
+    graph: RoadGraph,
+    sources: np.ndarray,
+    targets: np.ndarray,
+    cutoffs: Optional[np.ndarray] = None,
+    progress: bool = False
+) -> List[Optional[np.ndarray]]:
+    """
+    Finds shortest paths for many source/target pairs. Pairs in different
+    connected components, or farther apart in a straight line than their
+    cutoff, are rejected without a search. The other pairs are grouped by
+    source: a source with a single target is routed with A*, otherwise one
+    shortest path tree is grown for all its targets.
+
+    Parameters
+    ----------
+    graph : RoadGraph
+        Graph created by road_graph.create_graph.
+    sources : numpy.ndarray
+        Ids of the start nodes.
+    targets : numpy.ndarray
+        Ids of the end nodes, one per source.
+    cutoffs : numpy.ndarray, optional
+        Maximum path length of each pair in meters (default is no limit).
+    progress : bool, optional
+        If True, shows a progress bar over the sources (default is False).
+
+    Returns
+    -------
+    list of numpy.ndarray or None
+        Edge ids along each path, see astar. None for pairs that are
+        unreachable within their cutoff. Paths longer than the cutoff may
+        still be returned for sources with several targets.
+    """
+    paths: List[Optional[np.ndarray]] = [None] * len(sources)
+    if not paths:
+        return paths
+    if cutoffs is None:
+        cutoffs = np.full(len(sources), inf)
+    labels: np.ndarray = component_labels(graph)
+    # No path is shorter than the great-circle distance between its ends
+    lower_bounds: np.ndarray = haversine(graph.nodes[sources, 0], graph.nodes[sources, 1],
+                                         graph.nodes[targets, 0], graph.nodes[targets, 1]) * HEURISTIC_SCALE
+    reachable: np.ndarray = np.flatnonzero((labels[sources] == labels[targets]) & (lower_bounds <= cutoffs))
+    if len(reachable) == 0:
+        return paths
+    order: np.ndarray = reachable[np.argsort(sources[reachable], kind='stable')]
+    group_starts: np.ndarray = np.unique(sources[order], return_index=True)[1]
+    groups: List[np.ndarray] = np.split(order, group_starts[1:])
+
+    for group in tqdm(groups, disable=not progress):
+        source: int = int(sources[group[0]])
+        group_targets: List[int] = targets[group].tolist()
+        if len(group) == 1:
+            paths[group[0]] = astar(graph, source, group_targets[0], float(cutoffs[group[0]]))
+            continue
+        predecessors: dict = shortest_path_tree(graph, source, group_targets, float(cutoffs[group].max()))
+        for i, target in zip(group.tolist(), group_targets):
+            paths[i] = trace_path(predecessors, source, target)
+    return paths
+
+
+def path_nodes(graph: RoadGraph, source: int, edges: np.ndarray) -> np.ndarray:
+    """
+    Lists the nodes visited by a path.
+
+    Parameters
+    ----------
+    graph : RoadGraph
+        Graph the path was found in.
+    source : int
+        Id of the start node.
+    edges : numpy.ndarray
+        Ids of the edges along the path, in order.
+
+    Returns
+    -------
+    numpy.ndarray
+        Node ids from source to the end of the path.
+    """
+    nodes: List[int] = [source]
+    for u, v in graph.edge_nodes[edges].tolist():
+        nodes.append(v if u == nodes[-1] else u)
+    return np.array(nodes, dtype=np.int64)
+
+
+def compute_landmarks(graph: RoadGraph, count: int) -> np.ndarray:
+    """
+    Selects landmarks for A* search and computes their distances to all nodes.
+    Landmarks are picked in the largest connected component, each as far as
+    possible from the ones picked before.
+
+    Parameters
+    ----------
+    graph : RoadGraph
+        Graph created by road_graph.create_graph.
+    count : int
+        Number of landmarks.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (count, n) with the path distance from every landmark
+        to every node, 0 where a node cannot be reached.
+    """
+    adjacency: csr_matrix = csr_matrix((graph.edge_weights[graph.slot_edges], graph.neighbors, graph.indptr),
+                                       shape=(len(graph.nodes), len(graph.nodes)))
+    labels: np.ndarray = component_labels(graph)
+    component: np.ndarray = np.flatnonzero(labels == np.bincount(labels).argmax())
+
+    # The first landmark is the node farthest from an arbitrary start node
+    closest: np.ndarray = dijkstra(adjacency, indices=component[0])
+    landmark_distances: np.ndarray = np.zeros((count, len(graph.nodes)))
+    for i in range(count):
+        landmark: int = int(component[np.argmax(closest[component])])
+        distances: np.ndarray = dijkstra(adjacency, indices=landmark)
+        closest = distances if i == 0 else np.minimum(closest, distances)
+        landmark_distances[i] = np.where(np.isfinite(distances), distances, 0.0)
+    return landmark_distances
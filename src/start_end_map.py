@@ -1,117 +1,206 @@
 from datetime import datetime
+from functools import lru_cache
 import geopandas as gpd
-from shapely.geometry import Point
-from tqdm import tqdm
 import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.colors import LogNorm
+import numpy as np
 import pandas as pd
-from typing import Optional
+from typing import List, Optional, Tuple
 
-def read_trips_file(filename: str, start_date: Optional[datetime] = None, end_date: Optional[datetime] = None) -> None:
+from heatmap_creator import road_lines
+from road_graph import EARTH_RADIUS, REFERENCE_LATITUDE, to_planar
+from trip_loader import select_date_range, within_bounds
+
+# Default road map drawn under the points
+BASEMAP_PATH: str = '../results/01-04-2023_30-04-2023.shp'
+
+# Default distance between the centers of neighbouring grid cells in meters
+CELL_SIZE: float = 250.0
+
+# Length of one degree of latitude in meters, the unit of road_graph.to_planar
+METERS_PER_DEGREE: float = EARTH_RADIUS * np.pi / 180
+
+
+@lru_cache(maxsize=None)
+def basemap_lines(shapefile_path: str) -> List[np.ndarray]:
+    """
+    Loads the road lines of a basemap. Every shapefile is read only once per process.
+
+    Parameters
+    ----------
+    shapefile_path : str
+        Path to a shapefile with road line geometries.
+
+    Returns
+    -------
+    list of numpy.ndarray
+        Coordinates of every road line part.
+    """
+    return road_lines(gpd.read_file(shapefile_path))[0]
+
+
+def bin_points(
+    longitudes: np.ndarray,
+    latitudes: np.ndarray,
+    cell_size: float = CELL_SIZE,
+    grid: str = 'square'
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Counts points per cell of a square or hexagonal grid laid over a local
+    plane, so cells have the same size in meters in both directions.
+
+    Parameters
+    ----------
+    longitudes : numpy.ndarray
+        Longitudes of the points.
+    latitudes : numpy.ndarray
+        Latitudes of the points.
+    cell_size : float, optional
+        Distance between the centers of neighbouring cells in meters (default is CELL_SIZE).
+    grid : str, optional
+        Cell shape, 'square' or 'hex' (default is 'square').
+
+    Returns
+    -------
+    polygons : numpy.ndarray
+        Array of shape (k, v, 2) with the corners (longitude, latitude) of every non-empty cell.
+    counts : numpy.ndarray
+        Number of points in every non-empty cell.
+    """
+    planar: np.ndarray = to_planar(longitudes, latitudes)
+    size: float = cell_size / METERS_PER_DEGREE
+
+    if grid == 'square':
+        cells: np.ndarray = np.floor(planar / size).astype(np.int64)
+        counts: np.ndarray
+        cells, counts = np.unique(cells, axis=0, return_counts=True)
+        corners: np.ndarray = np.array([[0, 0], [1, 0], [1, 1], [0, 1]])
+        polygons: np.ndarray = (cells[:, None, :] + corners[None, :, :]) * size
+    elif grid == 'hex':
+        # Axial coordinates of pointy-top hexagons, rounded to the nearest cell in cube coordinates
+        radius: float = size / np.sqrt(3)
+        q: np.ndarray = (np.sqrt(3) / 3 * planar[:, 0] - planar[:, 1] / 3) / radius
+        r: np.ndarray = 2 / 3 * planar[:, 1] / radius
+        cube: np.ndarray = np.column_stack((q, -q - r, r))
+        rounded: np.ndarray = np.rint(cube)
+        errors: np.ndarray = np.abs(rounded - cube)
+        largest: np.ndarray = errors.argmax(axis=1)
+        rows: np.ndarray = np.arange(len(cube))
+        rounded[rows, largest] = -(rounded.sum(axis=1) - rounded[rows, largest])
+        cells, counts = np.unique(rounded[:, [0, 2]].astype(np.int64), axis=0, return_counts=True)
+
+        centers: np.ndarray = radius * np.column_stack((np.sqrt(3) * (cells[:, 0] + cells[:, 1] / 2),
+                                                        1.5 * cells[:, 1]))
+        angles: np.ndarray = np.radians(30 + 60 * np.arange(6))
+        polygons = centers[:, None, :] + radius * np.column_stack((np.cos(angles), np.sin(angles)))[None, :, :]
+    else:
+        raise ValueError(f"Unknown grid: {grid}")
+
+    # Back from the local plane to longitude and latitude
+    polygons[..., 0] /= np.cos(np.radians(REFERENCE_LATITUDE))
+    return polygons, counts
+
+
+def create_points_map(
+    trips_df: pd.DataFrame,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    shapefile_path: str = BASEMAP_PATH,
+    cell_size: float = CELL_SIZE,
+    grid: str = 'square'
+) -> None:
     """
-    Reads a CSV file containing trip data, aggregates start and end points,
-    and plots them on a map using a shapefile of the city roads as a base.
+    Bins start and end points of the trip table into grid cells and plots both
+    layers side by side on a map, using a shapefile of the city roads as a base.
 
     Parameters
     ----------
-    filename : str
-        Path to the CSV file containing trip data.
+    trips_df : pandas.DataFrame
+        Trip table returned by trip_loader.load_trips.
     start_date : datetime, optional
         Start date for filtering trips (inclusive). Default is None.
     end_date : datetime, optional
         End date for filtering trips (inclusive). Default is None.
+    shapefile_path : str, optional
+        Path to the road shapefile drawn as the base map (default is BASEMAP_PATH).
+    cell_size : float, optional
+        Distance between the centers of neighbouring cells in meters (default is CELL_SIZE).
+    grid : str, optional
+        Cell shape, 'square' or 'hex' (default is 'square').
 
     Returns
     -------
     None
-        Saves a PNG file with aggregated trip points plotted on the city map.
+        Saves a PNG file with binned trip starts and ends plotted on the city map.
     """
-    # Define geographic boundaries (Chicago area) with a margin
-    margin: float = 0.1
-    lon_min: float = -87.89370076 - margin
-    lon_max: float = -87.5349023379022 + margin
-    lat_min: float = 41.66013746994182 - margin
-    lat_max: float = 42.00962338 + margin
-
-    # Load city roads shapefile
-    city_df: gpd.GeoDataFrame = gpd.read_file('../results/01-04-2023_30-04-2023.shp')
-
-    points: list[tuple[float, float]] = []
-
-    # Count total lines for progress bar
-    number_of_lines: int = sum(1 for _ in open(filename))
-    with open(filename, 'r') as file:
-        file.readline()  # skip header
-        for _ in tqdm(range(number_of_lines - 1)):
-            line: list[str] = list(file.readline().split(','))
-
-            # Parse trip start and end times
-            try:
-                start_time: datetime = datetime.strptime(line[1], "%m/%d/%Y %I:%M:%S %p")
-                end_time: datetime = datetime.strptime(line[2], "%m/%d/%Y %I:%M:%S %p")
-            except ValueError:
-                continue  # skip rows with invalid datetime
-
-            # Filter trips outside the date range
-            if not (start_date <= start_time <= end_date or start_date <= end_time <= end_date):
-                continue
-
-            # Skip rows with missing coordinates
-            if line[10] == '' or line[11] == '' or line[13] == '' or line[14] == '':
-                continue
-
-            # Parse coordinates
-            start_latitude: float = float(line[10])
-            start_longitude: float = float(line[11])
-            end_latitude: float = float(line[13])
-            end_longitude: float = float(line[14])
-
-            # Filter points within geographic boundaries
-            if lon_min <= start_longitude <= lon_max and lat_min <= start_latitude <= lat_max:
-                points.append((start_longitude, start_latitude))
-            if lon_min <= end_longitude <= lon_max and lat_min <= end_latitude <= lat_max:
-                points.append((end_longitude, end_latitude))
-
-    # Aggregate points by location
-    points_df: pd.DataFrame = pd.DataFrame(points, columns=['longitude', 'latitude'])
-    points_agg: pd.DataFrame = points_df.groupby(['longitude', 'latitude']).size().reset_index(name='counts')
-
-    # Create GeoDataFrame for plotting
-    geometry: list[Point] = [Point(xy) for xy in zip(points_agg['longitude'], points_agg['latitude'])]
-    gdf_points: gpd.GeoDataFrame = gpd.GeoDataFrame(points_agg, geometry=geometry)
-
-    # Plot city map and aggregated points
-    fig, ax = plt.subplots(figsize=(12, 12))
-    ax.set_ylim((41.66013746994182, 42.00962338))
-    ax.set_xlim((-87.80370076, -87.5349023379022))
-    plt.xticks([])
-    plt.yticks([])
-    city_df.plot(ax=ax, zorder=1, edgecolor='k')
-    gdf_points.plot(ax=ax, zorder=2, color='blue', markersize=gdf_points['counts'] * 0.05)
-
-    plt.title('Aggregated Trip Points Map')
-    plt.savefig(f"{start_date.strftime('%d-%m-%Y')}_{end_date.strftime('%d-%m-%Y')}_points.png",
+    # Filter trips outside the date range and rows with missing coordinates
+    trips_df = select_date_range(trips_df, start_date, end_date)
+    trips_df = trips_df.dropna(subset=['start_latitude', 'start_longitude', 'end_latitude', 'end_longitude'])
+
+    fig, axes = plt.subplots(1, 2, figsize=(24, 12))
+    for ax, side, title in zip(axes, ('start', 'end'), ('Trip starts', 'Trip ends')):
+        # Bin the points within geographic boundaries
+        longitudes: pd.Series = trips_df[f"{side}_longitude"]
+        latitudes: pd.Series = trips_df[f"{side}_latitude"]
+        inside: np.ndarray = within_bounds(longitudes, latitudes)
+        polygons: np.ndarray
+        counts: np.ndarray
+        polygons, counts = bin_points(longitudes.to_numpy()[inside], latitudes.to_numpy()[inside], cell_size, grid)
+
+        ax.add_collection(LineCollection(basemap_lines(shapefile_path), colors='k', linewidths=0.5, zorder=1))
+        if len(counts):
+            cells: PolyCollection = PolyCollection(polygons, array=counts, cmap='plasma', norm=LogNorm(),
+                                                   edgecolors='none', alpha=0.8, zorder=2)
+            ax.add_collection(cells)
+            fig.colorbar(cells, ax=ax, shrink=0.7).set_label("Number of trips")
+
+        ax.set_aspect(1 / np.cos(np.radians(REFERENCE_LATITUDE)))
+        ax.set_ylim((41.66013746994182, 42.00962338))
+        ax.set_xlim((-87.80370076, -87.5349023379022))
+        ax.set_xticks([])
+        ax.set_yticks([])
+        ax.set_title(title)
+
+    fig.suptitle('Aggregated Trip Points Map')
+    fig.savefig(f"{start_date.strftime('%d-%m-%Y')}_{end_date.strftime('%d-%m-%Y')}_points.png",
                 bbox_inches='tight')
+    plt.close(fig)
 
 
-def create_start_end_map(csv_file: str, start_day: str, end_day: str) -> None:
+def create_start_end_map(
+    trips_df: pd.DataFrame,
+    start_day: str,
+    end_day: str,
+    shapefile_path: str = BASEMAP_PATH,
+    cell_size: float = CELL_SIZE,
+    grid: str = 'square'
+) -> None:
     """
     Wrapper function to convert date strings to datetime objects
     and generate an aggregated start/end point map.
 
     Parameters
     ----------
-    csv_file : str
-        Path to the CSV file containing trip data.
+    trips_df : pandas.DataFrame
+        Trip table returned by trip_loader.load_trips.
     start_day : str
         Start date in the format 'dd/mm/yyyy'.
     end_day : str
         End date in the format 'dd/mm/yyyy'.
+    shapefile_path : str, optional
+        Path to the road shapefile drawn as the base map (default is BASEMAP_PATH).
+    cell_size : float, optional
+        Distance between the centers of neighbouring cells in meters (default is CELL_SIZE).
+    grid : str, optional
+        Cell shape, 'square' or 'hex' (default is 'square').
 
     Returns
     -------
     None
-        Calls read_trips_file to process trips and generate the map.
+        Calls create_points_map to process trips and generate the map.
     """
     start_date: datetime = datetime.strptime(f"{start_day} 00:00:00", "%d/%m/%Y %H:%M:%S")
     end_date: datetime = datetime.strptime(f"{end_day} 23:59:59", "%d/%m/%Y %H:%M:%S")
-    read_trips_file(csv_file, start_date=start_date, end_date=end_date)
+    create_points_map(trips_df, start_date=start_date, end_date=end_date, shapefile_path=shapefile_path,
+                      cell_size=cell_size, grid=grid)
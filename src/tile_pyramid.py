@@ -0,0 +1,249 @@
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import os
+import geopandas as gpd
+import numpy as np
+import shapely
+from matplotlib.axes import Axes
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection
+from matplotlib.colors import Normalize
+from matplotlib.figure import Figure
+from shapely.strtree import STRtree
+from tqdm import tqdm
+from typing import Dict, List, Optional, Tuple
+
+from trip_loader import LAT_MAX, LAT_MIN, LON_MAX, LON_MIN
+
+# Tile edge length in pixels
+TILE_SIZE: int = 256
+
+# Line widths in pixels of roads with and without trips
+USED_ROAD_WIDTH: float = 2.0
+UNUSED_ROAD_WIDTH: float = 0.5
+
+# Tiles rendered per task sent to a worker process
+TILES_PER_TASK: int = 64
+
+# Roads of a worker process, set by init_tile_worker
+worker_roads: Optional[dict] = None
+
+
+def to_world_pixels(longitudes: np.ndarray, latitudes: np.ndarray) -> np.ndarray:
+    """
+    Projects coordinates to Web Mercator pixels of zoom level 0, where the
+    whole world is a single tile.
+
+    Parameters
+    ----------
+    longitudes : numpy.ndarray
+        Longitudes of the points.
+    latitudes : numpy.ndarray
+        Latitudes of the points.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (n, 2) with pixel coordinates, y growing southwards.
+    """
+    x: np.ndarray = (np.asarray(longitudes) + 180) / 360 * TILE_SIZE
+    y: np.ndarray = (1 - np.arcsinh(np.tan(np.radians(latitudes))) / np.pi) / 2 * TILE_SIZE
+    return np.column_stack((x, y))
+
+
+def to_coordinates(pixels: np.ndarray) -> np.ndarray:
+    """
+    Converts zoom level 0 Web Mercator pixels back to coordinates.
+
+    Parameters
+    ----------
+    pixels : numpy.ndarray
+        Array of shape (n, 2) with pixel coordinates.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape (n, 2) with longitudes and latitudes.
+    """
+    longitudes: np.ndarray = pixels[:, 0] / TILE_SIZE * 360 - 180
+    latitudes: np.ndarray = np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * pixels[:, 1] / TILE_SIZE))))
+    return np.column_stack((longitudes, latitudes))
+
+
+def covering_tiles(zoom: int) -> List[Tuple[int, int]]:
+    """
+    Lists the tiles of a zoom level covering the Chicago bounding box.
+
+    Parameters
+    ----------
+    zoom : int
+        Zoom level.
+
+    Returns
+    -------
+    list of tuple of int
+        (x, y) index of every tile.
+    """
+    corners: np.ndarray = to_world_pixels([LON_MIN, LON_MAX], [LAT_MAX, LAT_MIN]) * 2 ** zoom / TILE_SIZE
+    (x_min, y_min), (x_max, y_max) = np.floor(corners).astype(int)
+    return [(x, y) for x in range(x_min, x_max + 1) for y in range(y_min, y_max + 1)]
+
+
+def init_tile_worker(shape_file: str) -> None:
+    """
+    Loads the roads of a result shapefile in a worker process, together with
+    a spatial index of their line parts and a figure reused for every tile.
+    The figure is drawn on its own Agg canvas, so the pyplot backend of the
+    process is left alone.
+
+    Parameters
+    ----------
+    shape_file : str
+        Path to the shapefile containing trip counts.
+    """
+    global worker_roads
+    geodataframe: gpd.GeoDataFrame = gpd.read_file(shape_file)
+    parts: np.ndarray
+    part_rows: np.ndarray
+    parts, part_rows = shapely.get_parts(geodataframe.geometry.to_numpy(), return_index=True)
+    coords: np.ndarray
+    coord_parts: np.ndarray
+    coords, coord_parts = shapely.get_coordinates(parts, return_index=True)
+    pixels: np.ndarray = to_world_pixels(coords[:, 0], coords[:, 1])
+
+    # One pixel square figure per tile, the axes fill it completely
+    fig: Figure = Figure(figsize=(1, 1), dpi=TILE_SIZE)
+    FigureCanvasAgg(fig)
+    ax: Axes = fig.add_axes((0, 0, 1, 1))
+    ax.set_axis_off()
+    collection: LineCollection = LineCollection([], cmap='plasma')
+    ax.add_collection(collection)
+    worker_roads = {
+        'df': geodataframe,
+        'part_rows': part_rows,
+        'lines': np.split(pixels, np.flatnonzero(np.diff(coord_parts)) + 1),
+        'index': STRtree(parts),
+        'figure': fig,
+        'axes': ax,
+        'collection': collection,
+    }
+
+
+def render_tiles(task: tuple) -> Dict[str, str]:
+    """
+    Renders a batch of tiles of one count column in the current process.
+    Tiles without roads are skipped, and so are tiles whose roads and counts
+    did not change since they were last written.
+
+    Parameters
+    ----------
+    task : tuple
+        Count column, zoom level, list of (x, y) tiles, (vmin, vmax) colour
+        range, output directory and the digests of the written tiles.
+
+    Returns
+    -------
+    dict
+        Digest of every tile with roads, by 'z/x/y' key.
+    """
+    column, zoom, tiles, color_range, output_dir, previous = task
+    counts: np.ndarray = worker_roads['df'][column].to_numpy()[worker_roads['part_rows']]
+    collection: LineCollection = worker_roads['collection']
+    collection.set_norm(Normalize(*color_range))
+    scale: int = 2 ** zoom
+
+    digests: Dict[str, str] = {}
+    for x, y in tiles:
+        # Line parts intersecting the tile
+        corners: np.ndarray = to_coordinates(np.array([[x, y + 1], [x + 1, y]]) * TILE_SIZE / scale)
+        parts: np.ndarray = np.sort(worker_roads['index'].query(shapely.box(*corners.ravel())))
+        if len(parts) == 0:
+            continue
+        key: str = f"{zoom}/{x}/{y}"
+        digest = hashlib.sha1(parts.tobytes())
+        digest.update(counts[parts].astype(np.float64).tobytes())
+        digest.update(json.dumps(list(map(float, color_range))).encode())
+        digests[key] = digest.hexdigest()
+        if previous.get(key) == digests[key] and os.path.exists(os.path.join(output_dir, f"{key}.png")):
+            continue
+
+        collection.set_segments([worker_roads['lines'][part] * scale for part in parts])
+        collection.set_array(counts[parts])
+        collection.set_linewidths(np.where(counts[parts] > 0, USED_ROAD_WIDTH, UNUSED_ROAD_WIDTH) * 72 / TILE_SIZE)
+        worker_roads['axes'].set_xlim(x * TILE_SIZE, (x + 1) * TILE_SIZE)
+        worker_roads['axes'].set_ylim((y + 1) * TILE_SIZE, y * TILE_SIZE)
+        os.makedirs(os.path.join(output_dir, str(zoom), str(x)), exist_ok=True)
+        worker_roads['figure'].savefig(os.path.join(output_dir, f"{key}.png"), transparent=True)
+    return digests
+
+
+def create_tile_pyramid(
+    shape_file: str,
+    output_dir: str = 'tiles',
+    min_zoom: int = 10,
+    max_zoom: int = 14,
+    workers: int = 1
+) -> None:
+    """
+    Renders the road counts of a result shapefile as XYZ tile pyramids, one
+    per count column, stored as '<output_dir>/<column>/<z>/<x>/<y>.png'. Only
+    tiles containing roads are written. Digests of the written tiles are kept
+    in 'manifest.json' of every column, so later renders after a count update
+    only redraw tiles whose roads or counts changed.
+
+    Parameters
+    ----------
+    shape_file : str
+        Path to the shapefile containing trip counts.
+    output_dir : str, optional
+        Directory to write the tiles to (default is 'tiles').
+    min_zoom : int, optional
+        Lowest zoom level to render (default is 10).
+    max_zoom : int, optional
+        Highest zoom level to render (default is 14).
+    workers : int, optional
+        Number of worker processes rendering tiles (default is 1).
+
+    Returns
+    -------
+    None
+        Writes PNG tiles and manifests.
+    """
+    attributes = gpd.read_file(shape_file, ignore_geometry=True)
+    columns: List[str] = [column for column in attributes.columns if column.startswith('count_')]
+
+    tasks: List[tuple] = []
+    manifests: Dict[str, dict] = {}
+    for column in columns:
+        column_dir: str = os.path.join(output_dir, column)
+        manifest_file: str = os.path.join(column_dir, 'manifest.json')
+        manifests[column] = {}
+        if os.path.exists(manifest_file):
+            with open(manifest_file) as file:
+                manifests[column] = json.load(file)
+
+        # Colours are scaled to the counts of the whole column, as in the heat maps
+        color_range: Tuple[float, float] = (float(attributes[column].min()), float(attributes[column].max()))
+        for zoom in range(min_zoom, max_zoom + 1):
+            tiles: List[Tuple[int, int]] = covering_tiles(zoom)
+            for i in range(0, len(tiles), TILES_PER_TASK):
+                tasks.append((column, zoom, tiles[i:i + TILES_PER_TASK], color_range, column_dir, manifests[column]))
+
+    digests: List[Dict[str, str]]
+    if workers > 1:
+        with ProcessPoolExecutor(workers, initializer=init_tile_worker, initargs=(shape_file,)) as executor:
+            digests = list(tqdm(executor.map(render_tiles, tasks), total=len(tasks)))
+    else:
+        init_tile_worker(shape_file)
+        digests = [render_tiles(task) for task in tqdm(tasks)]
+
+    # Tiles that no longer contain roads keep their old files but leave the manifest
+    for column in columns:
+        manifests[column] = {}
+    for task, task_digests in zip(tasks, digests):
+        manifests[task[0]].update(task_digests)
+    for column in columns:
+        os.makedirs(os.path.join(output_dir, column), exist_ok=True)
+        with open(os.path.join(output_dir, column, 'manifest.json'), 'w') as file:
+            json.dump(manifests[column], file)
@@ -1,26 +1,30 @@
 import geopandas as gpd
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
-from shapely.geometry import LineString
+from matplotlib.collections import LineCollection
+from matplotlib.colors import LogNorm
 from datetime import datetime
-from tqdm import tqdm
-from collections import defaultdict
-from typing import Optional
+from typing import Optional, Tuple
 
+from trip_loader import select_date_range, within_bounds
 
-def read_trips_file(
-    filename: str,
+# Size of the image routes are accumulated into in raster mode (rows, columns)
+RASTER_SHAPE: Tuple[int, int] = (800, 800)
+
+
+def filter_trips(
+    trips_df: pd.DataFrame,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None
 ) -> pd.DataFrame:
     """
-    Reads a CSV file containing trip data, filters by date and geographic bounds,
-    and returns a DataFrame with valid trips.
+    Filters the trip table by date and geographic bounds and returns the valid trips.
 
     Parameters
     ----------
-    filename : str
-        Path to the CSV file containing trip data.
+    trips_df : pandas.DataFrame
+        Trip table returned by trip_loader.load_trips.
     start_date : datetime, optional
         Start of the date range for filtering trips (inclusive).
     end_date : datetime, optional
@@ -32,63 +36,95 @@ def read_trips_file(
         DataFrame with columns: start_time, end_time, start_latitude, start_longitude,
         end_latitude, end_longitude.
     """
-    # Define geographic boundaries (Chicago area) with margin
-    margin = 0.1
-    lon_min = -87.89370076 - margin
-    lon_max = -87.5349023379022 + margin
-    lat_min = 41.66013746994182 - margin
-    lat_max = 42.00962338 + margin
-
-    trips: list[dict] = []
-
-    # Count total lines for progress bar
-    number_of_lines = sum(1 for _ in open(filename))
-    with open(filename, 'r') as file:
-        file.readline()  # skip header
-        for _ in tqdm(range(number_of_lines - 1)):
-            line = list(file.readline().split(','))
-
-            # Parse trip times
-            try:
-                start_time: datetime = datetime.strptime(line[1], "%m/%d/%Y %I:%M:%S %p")
-                end_time: datetime = datetime.strptime(line[2], "%m/%d/%Y %I:%M:%S %p")
-            except ValueError:
-                continue  # skip invalid dates
-
-            # Filter trips outside date range
-            if not (start_date <= start_time <= end_date or start_date <= end_time <= end_date):
-                continue
-
-            # Skip trips with missing coordinates
-            if line[10] == '' or line[11] == '' or line[13] == '' or line[14] == '':
-                continue
-
-            # Parse coordinates
-            start_latitude: float = float(line[10])
-            start_longitude: float = float(line[11])
-            end_latitude: float = float(line[13])
-            end_longitude: float = float(line[14])
-
-            # Filter trips within geographic boundaries
-            if lon_min <= start_longitude <= lon_max and lat_min <= start_latitude <= lat_max:
-                trips.append({
-                    'start_time': start_time,
-                    'end_time': end_time,
-                    'start_latitude': start_latitude,
-                    'start_longitude': start_longitude,
-                    'end_latitude': end_latitude,
-                    'end_longitude': end_longitude
-                })
-
-    trips_df: pd.DataFrame = pd.DataFrame(trips)
-    return trips_df
+    trips_df = select_date_range(trips_df, start_date, end_date)
+
+    # Skip trips with missing coordinates
+    trips_df = trips_df.dropna(subset=['start_latitude', 'start_longitude', 'end_latitude', 'end_longitude'])
+
+    # Filter trips within geographic boundaries
+    trips_df = trips_df[within_bounds(trips_df['start_longitude'], trips_df['start_latitude'])]
+    return trips_df[['start_time', 'end_time', 'start_latitude', 'start_longitude',
+                     'end_latitude', 'end_longitude']].reset_index(drop=True)
+
+
+def count_routes(trips_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Counts trips per route. A route is an unordered pair of points, so trips
+    in both directions between the same points share one route.
+
+    Parameters
+    ----------
+    trips_df : pandas.DataFrame
+        DataFrame containing trip start and end coordinates.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Columns x_1, y_1, x_2, y_2 with the route ends, (x_1, y_1) being the
+        smaller point, and 'count'. Routes are listed in order of first appearance.
+    """
+    start_lon: np.ndarray = trips_df['start_longitude'].to_numpy()
+    start_lat: np.ndarray = trips_df['start_latitude'].to_numpy()
+    end_lon: np.ndarray = trips_df['end_longitude'].to_numpy()
+    end_lat: np.ndarray = trips_df['end_latitude'].to_numpy()
+
+    # Order the ends of every route, comparing longitude first and latitude second
+    swap: np.ndarray = (start_lon > end_lon) | ((start_lon == end_lon) & (start_lat > end_lat))
+    routes: pd.DataFrame = pd.DataFrame({
+        'x_1': np.where(swap, end_lon, start_lon),
+        'y_1': np.where(swap, end_lat, start_lat),
+        'x_2': np.where(swap, start_lon, end_lon),
+        'y_2': np.where(swap, start_lat, end_lat),
+    })
+    return routes.groupby(['x_1', 'y_1', 'x_2', 'y_2'], sort=False).size().rename('count').reset_index()
+
+
+def rasterize_routes(routes: pd.DataFrame, limits: tuple, shape: Tuple[int, int] = RASTER_SHAPE) -> np.ndarray:
+    """
+    Draws routes into an image buffer. Every pixel a route passes through is
+    increased by the route's trip count.
+
+    Parameters
+    ----------
+    routes : pandas.DataFrame
+        Routes returned by count_routes.
+    limits : tuple
+        ((x_min, x_max), (y_min, y_max)) area covered by the image.
+    shape : tuple of int, optional
+        Number of image rows and columns (default is RASTER_SHAPE).
+
+    Returns
+    -------
+    numpy.ndarray
+        Image of the given shape with trip counts, row 0 at y_min.
+    """
+    (x_min, x_max), (y_min, y_max) = limits
+    rows, columns = shape
+    x_1: np.ndarray = (routes['x_1'].to_numpy() - x_min) / (x_max - x_min) * (columns - 1)
+    y_1: np.ndarray = (routes['y_1'].to_numpy() - y_min) / (y_max - y_min) * (rows - 1)
+    dx: np.ndarray = (routes['x_2'].to_numpy() - x_min) / (x_max - x_min) * (columns - 1) - x_1
+    dy: np.ndarray = (routes['y_2'].to_numpy() - y_min) / (y_max - y_min) * (rows - 1) - y_1
+
+    # Sample every route about once per pixel along its longer axis
+    steps: np.ndarray = np.ceil(np.maximum(np.abs(dx), np.abs(dy))).astype(np.int64) + 1
+    route_ids: np.ndarray = np.repeat(np.arange(len(routes)), steps)
+    positions: np.ndarray = np.arange(len(route_ids)) - np.repeat(np.cumsum(steps) - steps, steps)
+    fractions: np.ndarray = positions / np.maximum(steps - 1, 1)[route_ids]
+    x: np.ndarray = np.rint(x_1[route_ids] + fractions * dx[route_ids]).astype(np.int64)
+    y: np.ndarray = np.rint(y_1[route_ids] + fractions * dy[route_ids]).astype(np.int64)
+
+    inside: np.ndarray = (x >= 0) & (x < columns) & (y >= 0) & (y < rows)
+    weights: np.ndarray = routes['count'].to_numpy()[route_ids[inside]]
+    image: np.ndarray = np.bincount(y[inside] * columns + x[inside], weights=weights, minlength=rows * columns)
+    return image.reshape(shape)
 
 
 def create_map(
     trips_df: pd.DataFrame,
     start_date: datetime,
     end_date: datetime,
-    shapefile_path: str
+    shapefile_path: str,
+    raster: bool = False
 ) -> None:
     """
     Creates a trajectory map by plotting all trips on top of a city shapefile.
@@ -103,6 +139,10 @@ def create_map(
         End date for title and file naming.
     shapefile_path : str
         Path to the city shapefile to use as a base map.
+    raster : bool, optional
+        If True, routes are accumulated into an image instead of being drawn
+        as lines, which keeps rendering time constant for any number of routes
+        (default is False).
 
     Returns
     -------
@@ -112,58 +152,64 @@ def create_map(
     city_gdf: gpd.GeoDataFrame = gpd.read_file(shapefile_path)
 
     # Aggregate trips by unique start-end pairs
-    route_counts: defaultdict = defaultdict(int)
-    for _, trip in trips_df.iterrows():
-        start_point: tuple[float, float] = (trip['start_longitude'], trip['start_latitude'])
-        end_point: tuple[float, float] = (trip['end_longitude'], trip['end_latitude'])
-        route: tuple[tuple[float, float], tuple[float, float]] = tuple(sorted([start_point, end_point]))  # order independent
-        route_counts[route] += 1
+    routes: pd.DataFrame = count_routes(trips_df)
 
     # Plot city map and trips
     fig, ax = plt.subplots(figsize=(12, 12))
     city_gdf.plot(ax=ax, color='lightgrey', edgecolor='black')
 
-    # Plot each route, width proportional to trip count
-    for route, count in route_counts.items():
-        line: LineString = LineString(route)
-        ax.plot(*line.xy, color='blue', linewidth=0.1 + count * 0.001, alpha=0.7)
-
-    ax.set_ylim((41.66013746994182, 42.00962338))
-    ax.set_xlim((-87.80370076, -87.5349023379022))
+    limits: tuple = ((-87.80370076, -87.5349023379022), (41.66013746994182, 42.00962338))
+    if raster:
+        # Pixels are shaded by the number of trips crossing them
+        image: np.ndarray = rasterize_routes(routes, limits)
+        ax.imshow(np.ma.masked_equal(image, 0), extent=(*limits[0], *limits[1]), origin='lower',
+                  cmap='plasma', norm=LogNorm(), aspect=ax.get_aspect(), alpha=0.7)
+    else:
+        # Draw all routes at once, width proportional to trip count
+        segments: np.ndarray = routes[['x_1', 'y_1', 'x_2', 'y_2']].to_numpy().reshape(-1, 2, 2)
+        ax.add_collection(LineCollection(segments, colors='blue', alpha=0.7,
+                                         linewidths=0.1 + routes['count'].to_numpy() * 0.001))
+
+    ax.set_ylim(limits[1])
+    ax.set_xlim(limits[0])
     ax.set_title('Trip Trajectory Map')
-    plt.xticks([])
-    plt.yticks([])
+    ax.set_xticks([])
+    ax.set_yticks([])
 
     map_filename: str = f"{start_date.strftime('%d-%m-%Y')}_{end_date.strftime('%d-%m-%Y')}_trajectory_map.png"
-    plt.savefig(map_filename, bbox_inches='tight')
+    fig.savefig(map_filename, bbox_inches='tight')
+    plt.close(fig)
 
 
 def create_trajectory_map(
-    csv_file: str,
+    trips_df: pd.DataFrame,
     start_day: str,
     end_day: str,
-    shapefile_path: str
+    shapefile_path: str,
+    raster: bool = False
 ) -> None:
     """
-    Wrapper function to generate a trajectory map from a CSV file of trips.
+    Wrapper function to generate a trajectory map from the trip table.
 
     Parameters
     ----------
-    csv_file : str
-        Path to the CSV file containing trip data.
+    trips_df : pandas.DataFrame
+        Trip table returned by trip_loader.load_trips.
     start_day : str
         Start date in the format 'dd/mm/yyyy'.
     end_day : str
         End date in the format 'dd/mm/yyyy'.
     shapefile_path : str
         Path to the city shapefile to plot on.
+    raster : bool, optional
+        If True, routes are accumulated into an image, see create_map (default is False).
 
     Returns
     -------
     None
-        Reads trip data and generates a trajectory map PNG file.
+        Filters trip data and generates a trajectory map PNG file.
     """
     start_date: datetime = datetime.strptime(f"{start_day} 00:00:00", "%d/%m/%Y %H:%M:%S")
     end_date: datetime = datetime.strptime(f"{end_day} 23:59:59", "%d/%m/%Y %H:%M:%S")
-    trips_df: pd.DataFrame = read_trips_file(csv_file, start_date=start_date, end_date=end_date)
-    create_map(trips_df, start_date, end_date, shapefile_path)
+    trips_df = filter_trips(trips_df, start_date=start_date, end_date=end_date)
+    create_map(trips_df, start_date, end_date, shapefile_path, raster=raster)
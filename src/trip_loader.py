@@ -0,0 +1,520 @@
+from datetime import datetime, timedelta
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from typing import BinaryIO, Dict, Iterable, Iterator, Optional, Union
+
+# Timestamp format used by the City of Chicago trip export
+TIME_FORMAT: str = "%m/%d/%Y %I:%M:%S %p"
+
+# Geographic bounds (Chicago + margin)
+MARGIN: float = 0.1
+LON_MIN: float = -87.89370076 - MARGIN
+LON_MAX: float = -87.5349023379022 + MARGIN
+LAT_MIN: float = 41.66013746994182 - MARGIN
+LAT_MAX: float = 42.00962338 + MARGIN
+
+# CSV column positions and the names they get in the trip table
+TRIP_COLUMNS: Dict[int, str] = {
+    1: 'start_time',
+    2: 'end_time',
+    3: 'trip_distance',
+    5: 'vendor',
+    10: 'start_latitude',
+    11: 'start_longitude',
+    13: 'end_latitude',
+    14: 'end_longitude',
+}
+
+# Number of CSV rows parsed at a time
+CHUNK_SIZE: int = 1_000_000
+
+# Bytes hashed at the head and tail of the CSV to detect in-place changes
+FINGERPRINT_BLOCK: int = 1 << 20
+
+# Trips whose end is farther than this from their start are looked up separately in the cache
+LONG_TRIP: timedelta = timedelta(days=1)
+
+
+def parse_timestamps(values: pd.Series) -> pd.Series:
+    """
+    Parses timestamps in the fixed TIME_FORMAT. Trip times are rounded in the
+    export, so each distinct string is parsed once and the result is broadcast
+    back to all rows that share it.
+
+    Parameters
+    ----------
+    values : pandas.Series
+        Timestamp strings.
+
+    Returns
+    -------
+    pandas.Series
+        Parsed timestamps, NaT where the string is missing or invalid.
+    """
+    codes: np.ndarray
+    uniques: pd.Index
+    codes, uniques = pd.factorize(values)
+    parsed: pd.DatetimeIndex = pd.to_datetime(uniques, format=TIME_FORMAT, errors='coerce')
+    # Missing strings get code -1 and take NaT from the appended slot
+    parsed = parsed.append(pd.DatetimeIndex([pd.NaT], dtype=parsed.dtype))
+    return pd.Series(parsed.take(codes), index=values.index)
+
+
+def clean_trip_chunk(chunk: pd.DataFrame) -> pd.DataFrame:
+    """
+    Turns a raw block of CSV rows into trip table rows.
+
+    Parameters
+    ----------
+    chunk : pandas.DataFrame
+        Rows read from the CSV, restricted to TRIP_COLUMNS.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Trip table rows. Rows with invalid timestamps are dropped.
+    """
+    chunk.columns = [TRIP_COLUMNS[i] for i in sorted(TRIP_COLUMNS)]
+
+    # Parse times and drop invalid rows
+    chunk['start_time'] = parse_timestamps(chunk['start_time'])
+    chunk['end_time'] = parse_timestamps(chunk['end_time'])
+    chunk = chunk[chunk['start_time'].notna().to_numpy() & chunk['end_time'].notna().to_numpy()]
+
+    chunk = chunk.assign(
+        trip_distance=pd.to_numeric(chunk['trip_distance'], errors='coerce').astype('float64'),
+        # Trip duration in minutes
+        duration=(chunk['end_time'] - chunk['start_time']).dt.total_seconds() / 60
+    )
+    return chunk
+
+
+def iter_trip_chunks(
+    filename: str,
+    chunksize: int = CHUNK_SIZE,
+    row_limits: Optional[int] = None,
+    offset: int = 0
+) -> Iterator[pd.DataFrame]:
+    """
+    Streams the trip CSV as blocks of trip table rows.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the CSV file containing trip data.
+    chunksize : int, optional
+        Number of CSV rows per block (default is CHUNK_SIZE).
+    row_limits : int, optional
+        Maximum number of rows to read from the CSV.
+    offset : int, optional
+        Byte offset of the first row to read. A non-zero offset must point to
+        the start of a data row (default is 0, the header).
+
+    Yields
+    ------
+    pandas.DataFrame
+        Trip table rows of one block, see clean_trip_chunk.
+    """
+    with open(filename, 'rb') as file:
+        file.seek(offset)
+        yield from parse_trip_chunks(file, chunksize, row_limits, header=offset == 0)
+
+
+def parse_trip_chunks(
+    file: BinaryIO,
+    chunksize: int = CHUNK_SIZE,
+    row_limits: Optional[int] = None,
+    header: bool = True
+) -> Iterator[pd.DataFrame]:
+    """
+    Parses trip CSV content from an open binary stream as blocks of trip table
+    rows. The stream is only read forward, so it may be a network download.
+
+    Parameters
+    ----------
+    file : BinaryIO
+        Stream positioned at the header or at the start of a data row.
+    chunksize : int, optional
+        Number of CSV rows per block (default is CHUNK_SIZE).
+    row_limits : int, optional
+        Maximum number of rows to read.
+    header : bool, optional
+        Whether the stream starts with the header row (default is True).
+
+    Yields
+    ------
+    pandas.DataFrame
+        Trip table rows of one block, see clean_trip_chunk.
+    """
+    with pd.read_csv(
+        file,
+        usecols=list(TRIP_COLUMNS),
+        header=0 if header else None,
+        nrows=row_limits,
+        dtype={1: str, 2: str, 3: str, 5: str, 10: float, 11: float, 13: float, 14: float},
+        chunksize=chunksize,
+    ) as reader:
+        for chunk in reader:
+            yield clean_trip_chunk(chunk)
+
+
+def concat_trip_chunks(chunks: Iterable[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Joins blocks of trip table rows into one trip table.
+
+    Parameters
+    ----------
+    chunks : iterable of pandas.DataFrame
+        Blocks of trip table rows, e.g. returned by parse_trip_chunks.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Trip table, see read_trips_csv.
+    """
+    trips_df: pd.DataFrame = pd.concat(list(chunks), ignore_index=True)
+    trips_df['vendor'] = trips_df['vendor'].astype('category')
+    return trips_df
+
+
+def read_trips_stream(file: BinaryIO) -> pd.DataFrame:
+    """
+    Parses trip CSV content arriving on a binary stream into a trip table.
+    Blocks are parsed as soon as they arrive, so parsing overlaps a download
+    feeding the stream.
+
+    Parameters
+    ----------
+    file : BinaryIO
+        Stream starting with the header row, see downloader.open_download.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Trip table, see read_trips_csv.
+    """
+    return concat_trip_chunks(parse_trip_chunks(file))
+
+
+def read_trips_csv(filename: str, row_limits: Optional[int] = None, offset: int = 0) -> pd.DataFrame:
+    """
+    Parses the trip CSV into a columnar trip table.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the CSV file containing trip data.
+    row_limits : int, optional
+        Maximum number of rows to read from the CSV.
+    offset : int, optional
+        Byte offset of the first row to read, see iter_trip_chunks.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Trip table with columns: start_time, end_time, trip_distance, vendor,
+        start_latitude, start_longitude, end_latitude, end_longitude, duration.
+        Rows with invalid timestamps are dropped.
+    """
+    return concat_trip_chunks(iter_trip_chunks(filename, row_limits=row_limits, offset=offset))
+
+
+def select_date_range(
+    trips_df: pd.DataFrame,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> pd.DataFrame:
+    """
+    Keeps trips that start or end inside the given date range.
+
+    Parameters
+    ----------
+    trips_df : pandas.DataFrame
+        Trip table returned by read_trips_csv.
+    start : datetime, optional
+        Start of the date range (default is earliest possible date).
+    end : datetime, optional
+        End of the date range (default is latest possible date).
+
+    Returns
+    -------
+    pandas.DataFrame
+        Trips overlapping the date range.
+    """
+    if start is None:
+        start = datetime.min
+    if end is None:
+        end = datetime.max
+    starts_inside: pd.Series = trips_df['start_time'].between(start, end)
+    ends_inside: pd.Series = trips_df['end_time'].between(start, end)
+    return trips_df[starts_inside | ends_inside].reset_index(drop=True)
+
+
+def within_bounds(longitude: pd.Series, latitude: pd.Series) -> np.ndarray:
+    """
+    Checks which coordinates fall inside the Chicago bounding box.
+
+    Parameters
+    ----------
+    longitude : pandas.Series
+        Longitudes to check.
+    latitude : pandas.Series
+        Latitudes to check.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean mask, True where the coordinate is inside the bounds.
+    """
+    return (longitude.between(LON_MIN, LON_MAX) & latitude.between(LAT_MIN, LAT_MAX)).to_numpy()
+
+
+def cache_path(filename: str) -> str:
+    """
+    Returns the directory holding the columnar cache of a trip CSV.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the CSV file containing trip data.
+
+    Returns
+    -------
+    str
+        Path of the cache directory.
+    """
+    return f"{filename}.cache"
+
+
+def source_signature(filename: str, size: Optional[int] = None) -> dict:
+    """
+    Describes the current state of a source file. The signature combines size,
+    modification time and hashes of the first and last megabyte of the file.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the source file.
+    size : int, optional
+        If given, describes only the first size bytes of the file, e.g. to check
+        whether a file was appended to (default is the whole file).
+
+    Returns
+    -------
+    dict
+        Signature with 'size', 'mtime_ns', 'head' and 'tail' keys.
+    """
+    stat: os.stat_result = os.stat(filename)
+    if size is None:
+        size = stat.st_size
+    with open(filename, 'rb') as file:
+        head: str = hashlib.sha1(file.read(min(size, FINGERPRINT_BLOCK))).hexdigest()
+        file.seek(max(FINGERPRINT_BLOCK, size - FINGERPRINT_BLOCK))
+        tail: str = hashlib.sha1(file.read(max(0, size - file.tell()))).hexdigest()
+    return {'size': size, 'mtime_ns': stat.st_mtime_ns, 'head': head, 'tail': tail}
+
+
+def is_appended(filename: str, signature: dict) -> bool:
+    """
+    Checks whether a file only had complete rows appended since its signature was taken.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the source file.
+    signature : dict
+        Earlier signature of the file, see source_signature.
+
+    Returns
+    -------
+    bool
+        True if the file grew and still starts with the described content,
+        ending in a line break. False for signatures without a file
+        fingerprint, e.g. of a cache streamed from a download.
+    """
+    if signature.get('size') is None or 'head' not in signature:
+        return False
+    if os.path.getsize(filename) <= signature['size']:
+        return False
+    with open(filename, 'rb') as file:
+        file.seek(signature['size'] - 1)
+        if file.read(1) != b'\n':
+            return False
+    current: dict = source_signature(filename, signature['size'])
+    return current['head'] == signature.get('head') and current['tail'] == signature.get('tail')
+
+
+def write_trips_cache(trips_df: pd.DataFrame, cache_dir: str, signature: dict) -> None:
+    """
+    Saves the trip table as one NumPy file per column. Rows are sorted by start
+    time, so read_trips_cache can find a date range by binary search. Rows of
+    trips lasting longer than LONG_TRIP (or ending before they start) are
+    listed separately, since their end time can be far from their position.
+
+    Parameters
+    ----------
+    trips_df : pandas.DataFrame
+        Trip table returned by read_trips_csv.
+    cache_dir : str
+        Directory to write the cache to. Existing content is replaced.
+    signature : dict
+        Signature of the source CSV, see source_signature.
+    """
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    os.makedirs(cache_dir)
+
+    trips_df = trips_df.take(np.argsort(trips_df['start_time'].to_numpy(), kind='stable')).reset_index(drop=True)
+    trip_lengths: pd.Series = trips_df['end_time'] - trips_df['start_time']
+    long_trips: np.ndarray = np.flatnonzero(((trip_lengths > LONG_TRIP) | (trip_lengths < -LONG_TRIP)).to_numpy())
+    np.save(os.path.join(cache_dir, 'long_trips.npy'), long_trips)
+
+    columns: dict = {}
+    for column in trips_df.columns:
+        series: pd.Series = trips_df[column]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(cache_dir, f"{column}.npy"), series.cat.codes.to_numpy())
+            columns[column] = {'dtype': 'category', 'categories': series.cat.categories.tolist()}
+        else:
+            values: np.ndarray = series.to_numpy()
+            np.save(os.path.join(cache_dir, f"{column}.npy"), values)
+            columns[column] = {'dtype': str(values.dtype)}
+
+    # Metadata is written last, so an interrupted write leaves no valid cache
+    with open(os.path.join(cache_dir, 'meta.json'), 'w') as file:
+        json.dump({'source': signature, 'columns': columns}, file)
+
+
+def cached_signature(cache_dir: str) -> Optional[dict]:
+    """
+    Returns the signature of the CSV a cache was built from.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory written by write_trips_cache.
+
+    Returns
+    -------
+    dict or None
+        Source signature stored in the cache, or None if there is no cache.
+    """
+    meta_file: str = os.path.join(cache_dir, 'meta.json')
+    if not os.path.exists(meta_file):
+        return None
+    with open(meta_file) as file:
+        return json.load(file)['source']
+
+
+def read_trips_cache(
+    cache_dir: str,
+    signature: dict,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+) -> Optional[pd.DataFrame]:
+    """
+    Loads the trip table from its columnar cache. Column files are memory-mapped,
+    so no parsing takes place. With a date range, only the rows that may overlap
+    it are read: trips starting within LONG_TRIP of the range, found by binary
+    search over the sorted start times, and the listed long trips.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory written by write_trips_cache.
+    signature : dict
+        Signature of the source CSV, see source_signature.
+    start : datetime, optional
+        Start of the date range to read (default is the first trip).
+    end : datetime, optional
+        End of the date range to read (default is the last trip).
+
+    Returns
+    -------
+    pandas.DataFrame or None
+        Cached trips, a superset of the trips overlapping the date range, or
+        None if the cache is missing or stale.
+    """
+    if cached_signature(cache_dir) != signature:
+        return None
+    with open(os.path.join(cache_dir, 'meta.json')) as file:
+        meta: dict = json.load(file)
+
+    start_times: np.ndarray = np.load(os.path.join(cache_dir, 'start_time.npy'), mmap_mode='r')
+    first: int = 0 if start is None else int(np.searchsorted(start_times, np.datetime64(start - LONG_TRIP)))
+    last: int = len(start_times) if end is None else int(np.searchsorted(start_times, np.datetime64(end + LONG_TRIP),
+                                                                         side='right'))
+    rows: Union[slice, np.ndarray] = slice(first, last)
+    long_trips: np.ndarray = np.load(os.path.join(cache_dir, 'long_trips.npy'))
+    outside: np.ndarray = long_trips[(long_trips < first) | (long_trips >= last)]
+    if len(outside):
+        rows = np.sort(np.concatenate((np.arange(first, last), outside)))
+
+    columns: dict = {}
+    for column, spec in meta['columns'].items():
+        values: np.ndarray = np.load(os.path.join(cache_dir, f"{column}.npy"), mmap_mode='r')[rows]
+        if spec['dtype'] == 'category':
+            columns[column] = pd.Categorical.from_codes(values, categories=spec['categories'])
+        else:
+            columns[column] = values
+    return pd.DataFrame(columns, copy=False)
+
+
+def load_trips(
+    filename: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    row_limits: Optional[int] = None,
+    use_cache: bool = True
+) -> pd.DataFrame:
+    """
+    Loads the trip table for a date range. The CSV is parsed once and the
+    resulting table is shared by all charts and maps.
+
+    The parsed table is cached next to the CSV the first time it is loaded,
+    later calls read only the rows of the date range from the cache instead of
+    parsing. If rows were appended to the CSV, only the new rows are parsed and
+    merged into the cache. Otherwise the cache is rebuilt whenever the size,
+    modification time or content fingerprint of the CSV changes. A cache
+    streamed from a download without keeping the CSV is read as it is, see
+    downloader.download_trips.
+
+    Parameters
+    ----------
+    filename : str
+        Path to the CSV file containing trip data.
+    start : datetime, optional
+        Start of the date range for filtering trips.
+    end : datetime, optional
+        End of the date range for filtering trips.
+    row_limits : int, optional
+        Maximum number of rows to read from the CSV. Limited reads bypass the cache.
+    use_cache : bool, optional
+        If False, always parse the CSV and leave the cache untouched (default is True).
+
+    Returns
+    -------
+    pandas.DataFrame
+        Trip table restricted to trips overlapping the date range.
+    """
+    if row_limits is not None or not use_cache:
+        return select_date_range(read_trips_csv(filename, row_limits=row_limits), start, end)
+
+    if not os.path.exists(filename) and cached_signature(cache_path(filename)) is not None:
+        return select_date_range(read_trips_cache(cache_path(filename), cached_signature(cache_path(filename)),
+                                                  start, end), start, end)
+
+    signature: dict = source_signature(filename)
+    trips_df: Optional[pd.DataFrame] = read_trips_cache(cache_path(filename), signature, start, end)
+    if trips_df is None:
+        previous: Optional[dict] = cached_signature(cache_path(filename))
+        if previous is not None and is_appended(filename, previous):
+            trips_df = concat_trip_chunks([read_trips_cache(cache_path(filename), previous),
+                                           read_trips_csv(filename, offset=previous['size'])])
+        else:
+            trips_df = read_trips_csv(filename)
+        write_trips_cache(trips_df, cache_path(filename), signature)
+    return select_date_range(trips_df, start, end)
@@ -0,0 +1,42 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+HEADER: str = ("trip_id,start_time,end_time,trip_distance,trip_duration,vendor,start_community_area_number,"
+               "end_community_area_number,start_community_area_name,end_community_area_name,"
+               "start_centroid_latitude,start_centroid_longitude,start_centroid_location,"
+               "end_centroid_latitude,end_centroid_longitude,end_centroid_location")
+
+
+def trip_row(i: int) -> str:
+    """
+    Returns one CSV row of the city trip export.
+
+    Parameters
+    ----------
+    i : int
+        Number of the trip, which sets its day, hour and vendor.
+
+    Returns
+    -------
+    str
+        Row without line break.
+    """
+    day: int = i % 28 + 1
+    hour: int = i % 12 + 1
+    vendor: str = ['Lime', 'Lyft', 'Link'][i % 3]
+    return (f"trip{i},04/{day:02d}/2023 {hour:02d}:00:00 AM,04/{day:02d}/2023 {hour:02d}:00:00 PM,"
+            f"{1000 + i}.0,600,{vendor},1,2,A,B,41.88,-87.63,POINT (-87.63 41.88),41.9,-87.65,POINT (-87.65 41.9)")
+
+
+@pytest.fixture
+def trip_csv(tmp_path) -> str:
+    """
+    Writes a small trip CSV in the column layout of the city trip export.
+    """
+    filename: str = str(tmp_path / 'source.csv')
+    with open(filename, 'w') as file:
+        file.write(HEADER + "\n" + "".join(trip_row(i) + "\n" for i in range(200)))
+    return filename
@@ -0,0 +1,48 @@
+import geopandas as gpd
+import numpy as np
+import pytest
+from shapely.geometry import LineString
+
+from dataframe_joiner import join_results
+from main import load_road_network
+
+
+@pytest.fixture
+def network(tmp_path, monkeypatch) -> gpd.GeoDataFrame:
+    """
+    Writes a small road shapefile into an empty working directory and returns
+    its compiled network. The second road is of a type the network leaves out.
+    """
+    monkeypatch.chdir(tmp_path)
+    roads: gpd.GeoDataFrame = gpd.GeoDataFrame({
+        'TYPE': ['residential', 'motorway', 'footway', 'residential'],
+        'NAME': ['a', 'b', 'c', 'd'],
+        'ONEWAY': ['no'] * 4,
+    }, geometry=[LineString([(-87.70 + 0.01 * i, 41.88), (-87.69 + 0.01 * i, 41.88)]) for i in range(4)],
+        crs='EPSG:4326')
+    roads.to_file('illinois_highway.shp')
+    return load_road_network()[0]
+
+
+def write_result(filename: str, network: gpd.GeoDataFrame, counts: np.ndarray, road_id: bool = True) -> None:
+    result: gpd.GeoDataFrame = network.assign(count_work=counts, count_lime=counts * 2)
+    if not road_id:
+        result = result.drop(columns='road_id')
+    result.to_file(filename)
+
+
+def test_join_matches_roads_by_id_and_legacy_files_by_position(network):
+    assert network['road_id'].tolist() == [0, 2, 3]
+    write_result('new.shp', network.iloc[::-1], np.array([1, 2, 3]))
+    write_result('legacy.shp', network, np.array([10, 20, 30]), road_id=False)
+
+    joined: gpd.GeoDataFrame = join_results(['new.shp', 'legacy.shp'])
+    assert joined['road_id'].tolist() == [0, 2, 3]
+    assert joined['count_work'].tolist() == [13, 22, 31]
+    assert joined['count_lime'].tolist() == [26, 44, 62]
+
+
+def test_legacy_file_of_another_network_is_rejected(network):
+    write_result('legacy.shp', network.iloc[:2], np.array([1, 2]), road_id=False)
+    with pytest.raises(ValueError, match="road_id"):
+        join_results(['legacy.shp'])
@@ -0,0 +1,248 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pandas as pd
+import pytest
+import requests
+
+import downloader
+from trip_loader import cache_path, load_trips, read_trips_csv
+
+# Small ranges, so a test file is split into several of them
+TEST_PART_SIZE: int = 64 << 10
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Serves the content of the server it belongs to, with an ETag derived from
+    the content. Byte ranges and If-Range are supported unless the server
+    disables them, and range requests can be made to fail.
+    """
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def send_headers(self, status: int, length: int) -> None:
+        self.send_response(status)
+        self.send_header('Content-Length', str(length))
+        self.send_header('ETag', self.server.etag())
+        if self.server.ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+
+    def do_HEAD(self) -> None:
+        self.send_headers(200, len(self.server.data))
+        self.end_headers()
+
+    def do_GET(self) -> None:
+        data: bytes = self.server.data
+        requested = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        if self.server.ranges and requested and (if_range is None or if_range == self.server.etag()):
+            with self.server.lock:
+                self.server.range_requests += 1
+                failed: bool = self.server.range_requests == self.server.fail_request
+            if failed:
+                self.send_headers(500, 0)
+                self.end_headers()
+                return
+            start, end = int(requested.group(1)), int(requested.group(2))
+            self.send_headers(206, end - start + 1)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+            self.end_headers()
+            self.wfile.write(data[start:end + 1])
+        else:
+            self.server.full_requests += 1
+            self.send_headers(200, len(data))
+            self.end_headers()
+            self.wfile.write(data)
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Local HTTP server standing in for the dataset hosts.
+    """
+
+    def __init__(self, data: bytes, ranges: bool = True) -> None:
+        super().__init__(('127.0.0.1', 0), StandInHandler)
+        self.data: bytes = data
+        self.ranges: bool = ranges
+        self.lock: threading.Lock = threading.Lock()
+        self.range_requests: int = 0
+        self.full_requests: int = 0
+        self.fail_request: int = 0
+
+    def etag(self) -> str:
+        return f'"{hashlib.sha1(self.data).hexdigest()[:16]}"'
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}/file"
+
+
+@pytest.fixture
+def serve():
+    """
+    Starts stand-in servers for the test and stops them afterwards.
+    """
+    servers = []
+
+    def start(data: bytes, ranges: bool = True) -> StandInServer:
+        server: StandInServer = StandInServer(data, ranges)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def small_parts(monkeypatch) -> None:
+    monkeypatch.setattr(downloader, 'PART_SIZE', TEST_PART_SIZE)
+
+
+@pytest.fixture
+def content() -> bytes:
+    return os.urandom(10 * TEST_PART_SIZE + 123)
+
+
+def test_ranged_download_is_identical(serve, content, tmp_path):
+    server: StandInServer = serve(content)
+    filename: str = str(tmp_path / 'file.bin')
+
+    assert downloader.download_file(server.url, filename)
+    with open(filename, 'rb') as file:
+        assert file.read() == content
+    assert server.range_requests == 11 and server.full_requests == 0
+    assert sorted(os.listdir(tmp_path)) == ['file.bin', 'file.bin' + downloader.METADATA_SUFFIX]
+
+
+def test_interrupted_download_resumes(serve, content, tmp_path):
+    server: StandInServer = serve(content)
+    filename: str = str(tmp_path / 'file.bin')
+    server.fail_request = 3
+
+    with pytest.raises(requests.HTTPError):
+        downloader.download_file(server.url, filename)
+    assert not os.path.exists(filename)
+    with open(filename + downloader.STATE_SUFFIX) as file:
+        done: list = json.load(file)['done']
+    assert len(done) == 10
+
+    # Only the failed range is fetched again
+    assert downloader.download_file(server.url, filename)
+    assert server.range_requests == 12
+    with open(filename, 'rb') as file:
+        assert file.read() == content
+    assert not os.path.exists(filename + downloader.STATE_SUFFIX)
+
+
+def test_server_without_ranges_uses_one_stream(serve, content, tmp_path):
+    server: StandInServer = serve(content, ranges=False)
+    filename: str = str(tmp_path / 'file.bin')
+
+    assert downloader.download_file(server.url, filename)
+    with open(filename, 'rb') as file:
+        assert file.read() == content
+    assert server.full_requests == 1 and server.range_requests == 0
+
+
+def test_unchanged_file_is_skipped(serve, content, tmp_path):
+    server: StandInServer = serve(content)
+    filename: str = str(tmp_path / 'file.bin')
+
+    assert downloader.download_file(server.url, filename)
+    requests_before: int = server.range_requests + server.full_requests
+    assert not downloader.download_file(server.url, filename)
+    assert server.range_requests + server.full_requests == requests_before
+
+    # A changed file is fetched again
+    server.data = content[::-1]
+    assert downloader.download_file(server.url, filename)
+    with open(filename, 'rb') as file:
+        assert file.read() == content[::-1]
+
+
+def test_change_during_download_is_detected(serve, content, tmp_path):
+    server: StandInServer = serve(content)
+    filename: str = str(tmp_path / 'file.bin')
+
+    with requests.Session() as session:
+        remote: dict = downloader.remote_metadata(session, server.url)
+        # The ETag sent with If-Range no longer matches, so the server answers with the whole file
+        server.data = content[::-1]
+        with pytest.raises(IOError):
+            downloader.download_parts(session, remote, filename + downloader.PART_SUFFIX, 2)
+
+    assert downloader.download_file(server.url, filename)
+    with open(filename, 'rb') as file:
+        assert file.read() == content[::-1]
+
+
+def test_open_download_streams_and_saves(serve, content, tmp_path):
+    server: StandInServer = serve(content)
+    filename: str = str(tmp_path / 'file.bin')
+
+    with downloader.open_download(server.url, filename) as stream:
+        assert stream.read() == content
+    with open(filename, 'rb') as file:
+        assert file.read() == content
+    assert downloader.is_current(filename, downloader.remote_metadata(requests.Session(), server.url))
+
+
+def test_download_trips_builds_cache_without_csv(serve, trip_csv, tmp_path):
+    with open(trip_csv, 'rb') as file:
+        server: StandInServer = serve(file.read(), ranges=False)
+    filename: str = str(tmp_path / 'trips.csv')
+
+    assert downloader.download_trips(server.url, filename, keep_csv=False)
+    assert not os.path.exists(filename)
+    assert os.path.isdir(cache_path(filename))
+    expected: pd.DataFrame = read_trips_csv(trip_csv).sort_values('start_time', kind='stable').reset_index(drop=True)
+    pd.testing.assert_frame_equal(load_trips(filename), expected)
+
+    assert not downloader.download_trips(server.url, filename, keep_csv=False)
+    assert server.full_requests == 1
+
+
+def test_file_without_validators_is_checked(tmp_path):
+    filename: str = str(tmp_path / 'file.bin')
+    with open(filename, 'wb') as file:
+        file.write(b'old download')
+    os.utime(filename, (1_600_000_000, 1_600_000_000))
+    remote: dict = {'url': 'http://127.0.0.1/file', 'size': None, 'etag': None, 'last_modified': None}
+
+    # Nothing to compare, so the file is fetched again
+    assert not downloader.is_current(filename, remote)
+    assert downloader.is_current(filename, {**remote, 'size': 12})
+    assert downloader.is_current(filename, {**remote, 'last_modified': 'Mon, 01 Jun 2020 00:00:00 GMT'})
+    assert not downloader.is_current(filename, {**remote, 'last_modified': 'Wed, 01 Mar 2023 00:00:00 GMT'})
+
+    # Stored metadata without ETag or Last-Modified cannot identify the version either
+    with open(filename + downloader.METADATA_SUFFIX, 'w') as file:
+        json.dump({**remote, 'size': 12}, file)
+    assert not downloader.is_current(filename, remote)
+    assert not downloader.is_current(filename, {**remote, 'size': 12})
+    assert not downloader.same_version({**remote, 'size': 12}, {**remote, 'size': 12})
+    assert downloader.same_version({**remote, 'etag': '"a"'}, {**remote, 'etag': '"a"'})
+
+
+def test_parts_without_validators_are_not_resumed(serve, content, tmp_path):
+    server: StandInServer = serve(content)
+    filename: str = str(tmp_path / 'file.bin')
+    # Parts of another version, recorded without ETag or Last-Modified
+    with open(filename + downloader.PART_SUFFIX, 'wb') as file:
+        file.write(content[::-1])
+    with open(filename + downloader.STATE_SUFFIX, 'w') as file:
+        json.dump({'url': server.url, 'size': len(content), 'etag': None, 'last_modified': None,
+                   'ranges': True, 'done': list(range(10))}, file)
+
+    assert downloader.download_file(server.url, filename)
+    assert server.range_requests == 11
+    with open(filename, 'rb') as file:
+        assert file.read() == content
@@ -0,0 +1,57 @@
+import os
+from datetime import datetime
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import LineString
+
+from main import count_trips_by_day, day_digests, load_road_network
+from trip_loader import read_trips_csv
+
+
+def test_day_digests_follow_trip_content(trip_csv):
+    trips_df: pd.DataFrame = read_trips_csv(trip_csv)
+    trip_days: np.ndarray = trips_df['start_time'].dt.day.to_numpy() - 1
+    digests = day_digests(trips_df, trip_days, 28, 1, 0.1)
+    assert len(set(digests)) == 28
+
+    # Reordering the trips keeps every digest
+    shuffled: np.ndarray = np.random.default_rng(0).permutation(len(trips_df))
+    assert day_digests(trips_df.iloc[shuffled], trip_days[shuffled], 28, 1, 0.1) == digests
+
+    # Moving one trip changes only its day, even though the number of trips stays the same
+    moved: pd.DataFrame = trips_df.copy()
+    moved.loc[0, 'end_latitude'] += 0.01
+    changed = day_digests(moved, trip_days, 28, 1, 0.1)
+    assert [i for i in range(28) if changed[i] != digests[i]] == [trip_days[0]]
+
+    # Other counting parameters change every digest
+    assert not set(day_digests(trips_df, trip_days, 28, 1, 0.2)) & set(digests)
+
+
+def test_unreadable_partition_is_counted_again(trip_csv, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    gpd.GeoDataFrame({'TYPE': ['residential'] * 3, 'NAME': ['a', 'b', 'c'], 'ONEWAY': ['no'] * 3},
+                     geometry=[LineString([(-87.66 + 0.01 * i, 41.88), (-87.65 + 0.01 * i, 41.89)]) for i in range(3)],
+                     crs='EPSG:4326').to_file('illinois_highway.shp')
+    city_df, graph_directory = load_road_network()
+    trips_df: pd.DataFrame = read_trips_csv(trip_csv)
+    start, end = datetime(2023, 4, 1), datetime(2023, 4, 3, 23, 59, 59)
+    trips_df = trips_df[trips_df['start_time'].between(start, end)]
+
+    counts, columns = count_trips_by_day(trips_df, city_df, graph_directory, start, end, 'daily')
+    network_dir: str = os.path.join('daily', os.path.basename(graph_directory))
+    assert sorted(os.listdir(network_dir)) == ['2023-04-01.npz', '2023-04-02.npz', '2023-04-03.npz']
+
+    # A partition cut short by an interrupted run
+    partition_file: str = os.path.join(network_dir, '2023-04-02.npz')
+    with open(partition_file, 'rb') as file:
+        data: bytes = file.read()
+    with open(partition_file, 'wb') as file:
+        file.write(data[:len(data) // 2])
+
+    recounted, recounted_columns = count_trips_by_day(trips_df, city_df, graph_directory, start, end, 'daily')
+    assert recounted_columns == columns
+    np.testing.assert_array_equal(recounted, counts)
+    with np.load(partition_file) as partition:
+        assert len(partition['counts']) == len(city_df)
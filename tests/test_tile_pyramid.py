@@ -0,0 +1,23 @@
+import os
+import geopandas as gpd
+import matplotlib
+from shapely.geometry import LineString
+
+from tile_pyramid import create_tile_pyramid
+
+
+def test_rendering_keeps_the_pyplot_backend(tmp_path):
+    shape_file: str = str(tmp_path / 'result.shp')
+    gpd.GeoDataFrame({'count_work': [0, 5]}, geometry=[
+        LineString([(-87.70, 41.88), (-87.65, 41.88)]), LineString([(-87.65, 41.88), (-87.65, 41.90)]),
+    ], crs='EPSG:4326').to_file(shape_file)
+    backend: str = matplotlib.get_backend()
+    matplotlib.use('svg')
+    try:
+        create_tile_pyramid(shape_file, str(tmp_path / 'tiles'), 10, 11)
+        assert matplotlib.get_backend() == 'svg'
+    finally:
+        matplotlib.use(backend)
+
+    tiles: list = [file for _, _, files in os.walk(tmp_path / 'tiles') for file in files if file.endswith('.png')]
+    assert len(tiles) >= 2
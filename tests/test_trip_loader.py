@@ -0,0 +1,24 @@
+import shutil
+import pandas as pd
+
+from trip_loader import cache_path, is_appended, load_trips, read_trips_csv, write_trips_cache
+
+# Signature of a cache streamed from a chunked download, without Content-Length
+STREAMED_SIGNATURE: dict = {'url': 'http://example.com/trips.csv', 'size': None, 'etag': None, 'last_modified': None}
+
+
+def test_streamed_signature_is_not_appended(trip_csv):
+    assert not is_appended(trip_csv, STREAMED_SIGNATURE)
+    assert not is_appended(trip_csv, {**STREAMED_SIGNATURE, 'size': 10})
+
+
+def test_csv_next_to_streamed_cache_is_parsed(trip_csv, tmp_path):
+    filename: str = str(tmp_path / 'trips.csv')
+    write_trips_cache(read_trips_csv(trip_csv).iloc[:50], cache_path(filename), STREAMED_SIGNATURE)
+    shutil.copy(trip_csv, filename)
+
+    trips_df: pd.DataFrame = load_trips(filename)
+    assert len(trips_df) == 200
+    # The rebuilt cache describes the CSV and is used by later calls
+    pd.testing.assert_frame_equal(load_trips(filename), read_trips_csv(trip_csv).sort_values(
+        'start_time', kind='stable').reset_index(drop=True))